@@ -0,0 +1,57 @@
+from hashlib import md5
+
+from django.core.cache import caches
+
+from recipes.catalog import CATALOG_VERSION_KEY
+from recipes.versions import (RECIPE_RESPONSES_VERSION_KEY, get_version,
+                              recipe_version_key)
+
+RESPONSE_CACHE_ALIAS = 'responses'
+HITS_KEY = 'api:responses:hits'
+MISSES_KEY = 'api:responses:misses'
+
+
+def get_response_cache():
+    return caches[RESPONSE_CACHE_ALIAS]
+
+
+def recipe_response_cache_key(request, recipe_id=None):
+    """Ключ ответа по нормализованному запросу и версиям данных."""
+    if recipe_id is None:
+        kind, version_key = 'list', RECIPE_RESPONSES_VERSION_KEY
+    else:
+        kind, version_key = f'detail:{recipe_id}', recipe_version_key(
+            recipe_id)
+    query = sorted((name, sorted(request.query_params.getlist(name)))
+                   for name in request.query_params)
+    parts = (request.scheme, request.get_host(), query,
+             get_version(CATALOG_VERSION_KEY), get_version(version_key))
+    return 'api:recipes:{}:{}'.format(
+        kind, md5(repr(parts).encode()).hexdigest())
+
+
+def count_event(key):
+    cache = get_response_cache()
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        pass
+
+
+def get_cached_response(key):
+    """Закэшированный ответ или None, с учётом попаданий и промахов."""
+    entry = get_response_cache().get(key)
+    count_event(MISSES_KEY if entry is None else HITS_KEY)
+    return entry
+
+
+def set_cached_response(key, entry):
+    get_response_cache().set(key, entry)
+
+
+def get_response_cache_stats():
+    """Счётчики попаданий и промахов кэша ответов."""
+    stats = get_response_cache().get_many([HITS_KEY, MISSES_KEY])
+    return {'hits': stats.get(HITS_KEY, 0),
+            'misses': stats.get(MISSES_KEY, 0)}
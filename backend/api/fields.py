@@ -0,0 +1,144 @@
+import binascii
+import posixpath
+from base64 import b64decode
+from hashlib import sha256
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from drf_base64.fields import Base64ImageField
+from PIL import Image
+from rest_framework import serializers
+
+IMAGE_EXTENSIONS = {'JPEG': 'jpg', 'PNG': 'png', 'GIF': 'gif', 'WEBP': 'webp'}
+DECODE_CHUNK_SIZE = 64 * 1024
+
+
+def decode_base64(data, offset):
+    """Части base64 из data начиная с offset, без пробельных символов.
+
+    Переносы строк допускаются в любом месте, поэтому каждая часть
+    выравнивается по 4 символа, а остаток переходит в следующую.
+    """
+    rest = ''
+    padded = False
+    for start in range(offset, len(data), DECODE_CHUNK_SIZE):
+        chunk = rest + ''.join(data[start:start + DECODE_CHUNK_SIZE].split())
+        end = len(chunk) - len(chunk) % 4
+        rest = chunk[end:]
+        if not end:
+            continue
+        if padded:
+            raise binascii.Error('Данные после дополнения base64.')
+        padded = chunk[end - 1] == '='
+        yield b64decode(chunk[:end], validate=True)
+    if rest:
+        yield b64decode(rest, validate=True)
+
+
+class DecodedImageFile(TemporaryUploadedFile):
+    """Временный файл, который хранилище перемещает при сохранении.
+
+    Закрывается вместе с объектом, иначе tempfile пытается удалить уже
+    перемещённый файл.
+    """
+
+    def __del__(self):
+        self.close()
+
+
+class ContentHashImageField(Base64ImageField):
+    """Изображение в base64, сохраняемое под хешем содержимого.
+
+    Base64 декодируется частями во временный файл, размер и число
+    пикселей проверяются до полного декодирования изображения, в том
+    числе у файлов, загруженных без base64. Повторная
+    загрузка того же файла не создаёт копию в хранилище, а ссылается на
+    уже сохранённый.
+    """
+    default_error_messages = {
+        'invalid_base64': 'Изображение должно быть закодировано в base64.',
+        'max_bytes': 'Размер изображения больше {max_bytes} байт.',
+        'max_pixels': 'Изображение больше {max_pixels} пикселей.',
+    }
+
+    def _decode(self, data):
+        max_bytes = settings.IMAGE_UPLOAD_MAX_BYTES
+        if not (isinstance(data, str) and data.startswith('data:')):
+            upload = super()._decode(data)
+            if hasattr(upload, 'read'):
+                if upload.size > max_bytes:
+                    upload.close()
+                    self.fail('max_bytes', max_bytes=max_bytes)
+                self.check_pixels(upload)
+            return upload
+        separator = data.find(';base64,', 0, 256)
+        if separator == -1:
+            self.fail('invalid_base64')
+        content_type = data[len('data:'):separator]
+        upload = DecodedImageFile(
+            f'upload.{content_type.split("/")[-1]}', content_type, 0, None)
+        digest = sha256()
+        try:
+            for chunk in decode_base64(data, separator + len(';base64,')):
+                digest.update(chunk)
+                upload.write(chunk)
+                if upload.tell() > max_bytes:
+                    upload.close()
+                    self.fail('max_bytes', max_bytes=max_bytes)
+        except (binascii.Error, ValueError):
+            upload.close()
+            self.fail('invalid_base64')
+        upload.size = upload.tell()
+        upload.content_hash = digest.hexdigest()
+        self.check_pixels(upload)
+        return upload
+
+    def check_pixels(self, upload):
+        """Проверка размеров по заголовку, без декодирования пикселей."""
+        max_pixels = settings.IMAGE_UPLOAD_MAX_PIXELS
+        upload.seek(0)
+        try:
+            with Image.open(upload) as image:
+                width, height = image.size
+        except Image.DecompressionBombError:
+            width, height = max_pixels + 1, 1
+        except Exception:
+            width, height = 0, 0
+        upload.seek(0)
+        if width * height > max_pixels:
+            upload.close()
+            self.fail('max_pixels', max_pixels=max_pixels)
+
+    def to_internal_value(self, data):
+        image = super().to_internal_value(data)
+        content_hash = getattr(image, 'content_hash', None)
+        if content_hash is None:
+            digest = sha256()
+            for chunk in image.chunks():
+                digest.update(chunk)
+            content_hash = digest.hexdigest()
+        extension = IMAGE_EXTENSIONS.get(
+            image.image.format, posixpath.splitext(image.name)[1][1:])
+        image.name = f'{content_hash}.{extension}'
+        model_field = self.parent.Meta.model._meta.get_field(self.source)
+        name = posixpath.join(model_field.upload_to, image.name)
+        if default_storage.exists(name):
+            return name
+        return image
+
+
+class ImageVariantsField(serializers.ReadOnlyField):
+    """Ссылки на копии изображения по формату и ширине"""
+
+    def to_representation(self, value):
+        request = self.context.get('request')
+        variants = {}
+        for file_format, names in value.items():
+            variants[file_format] = {}
+            for width, name in names.items():
+                url = default_storage.url(name)
+                if request is not None:
+                    url = request.build_absolute_uri(url)
+                variants[file_format][width] = url
+        return variants
@@ -1,20 +1,33 @@
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connections
+from django.db.models import (Case, Exists, F, IntegerField, OuterRef, Q,
+                              Value, When)
 from django_filters.rest_framework import FilterSet, filters
 
-from recipes.models import Ingredient, Recipe, Tag
+from recipes.catalog import get_catalog
+from recipes.models import Ingredient, Recipe
 from users.models import User
 
+INGREDIENT_SEARCH_LIMIT = 20
+
 
 class FilterIngredient(FilterSet):
     """Фильтр для ингредиентов."""
     name = filters.CharFilter(
-        field_name='name',
-        lookup_expr='icontains',
+        method='filter_name',
         label='Ингредиенты')
 
     class Meta:
         model = Ingredient
         fields = ('name',)
 
+    def filter_name(self, queryset, name, value):
+        """Поиск для автодополнения: сначала совпадения по началу."""
+        return queryset.filter(name__icontains=value).annotate(
+            rank=Case(When(name__istartswith=value, then=Value(0)),
+                      default=Value(1), output_field=IntegerField())
+        ).order_by('rank', 'name')[:INGREDIENT_SEARCH_LIMIT]
+
 
 class FilterRecipe(FilterSet):
     """Фильтр для рецептов."""
@@ -22,11 +35,13 @@ class FilterRecipe(FilterSet):
         field_name='author',
         queryset=User.objects.all(),
         label='Автор')
-    tags = filters.ModelMultipleChoiceFilter(
-        field_name='tags__slug',
-        queryset=Tag.objects.all(),
-        to_field_name='slug',
+    tags = filters.MultipleChoiceFilter(
+        method='filter_tags',
+        choices=lambda: [(tag.slug, tag.name) for tag in get_catalog().tags],
         label='Теги')
+    search = filters.CharFilter(
+        method='filter_search',
+        label='Поиск')
     is_favorited = filters.BooleanFilter(
         method='filter_is_favorited',
         label='В избранном')
@@ -36,15 +51,34 @@ class FilterRecipe(FilterSet):
 
     class Meta:
         model = Recipe
-        fields = ('tags', 'author', 'is_favorited',
+        fields = ('tags', 'author', 'search', 'is_favorited',
                   'is_in_shopping_cart')
 
+    def filter_tags(self, queryset, name, value):
+        """Рецепты с любым из тегов, без JOIN и DISTINCT."""
+        if not value:
+            return queryset
+        tags_by_slug = get_catalog().tags_by_slug
+        return queryset.filter(Exists(Recipe.tags.through.objects.filter(
+            recipe=OuterRef('pk'),
+            tag__in=[tags_by_slug[slug].id for slug in value])))
+
+    def filter_search(self, queryset, name, value):
+        """Полнотекстовый поиск по названию и описанию с ранжированием."""
+        if connections[queryset.db].vendor != 'postgresql':
+            return queryset.filter(
+                Q(name__icontains=value) | Q(text__icontains=value))
+        query = SearchQuery(value, config='russian', search_type='websearch')
+        return queryset.filter(search_vector=query).annotate(
+            rank=SearchRank(F('search_vector'), query)
+        ).order_by('-rank', 'id')
+
     def filter_is_favorited(self, queryset, name, value):
         user = self.request.user
         if user.is_anonymous:
             return queryset
         if value:
-            return queryset.filter(favoriterecipes__user=user)
+            return queryset.filter(is_favorited=True)
         return queryset
 
     def filter_is_in_shopping_cart(self, queryset, name, value):
@@ -52,5 +86,5 @@ class FilterRecipe(FilterSet):
         if user.is_anonymous:
             return queryset
         if value:
-            return queryset.filter(shoppingcarts__user=user)
+            return queryset.filter(is_in_shopping_cart=True)
         return queryset
@@ -0,0 +1,230 @@
+import logging
+import os
+import time
+from collections import Counter, defaultdict
+from contextlib import ExitStack, nullcontext
+from threading import Lock
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.http import Http404, HttpResponse
+from django.utils.crypto import constant_time_compare
+
+from .caches import get_response_cache_stats
+
+logger = logging.getLogger(__name__)
+
+METRICS = (
+    ('requests_total', 'counter', 'Количество запросов.'),
+    ('request_duration_seconds_total', 'counter',
+     'Суммарное время обработки запросов.'),
+    ('db_queries_total', 'counter', 'Количество SQL-запросов.'),
+    ('db_duration_seconds_total', 'counter', 'Суммарное время SQL-запросов.'),
+    ('serialize_duration_seconds_total', 'counter',
+     'Суммарное время сериализации без SQL-запросов.'),
+    ('render_duration_seconds_total', 'counter',
+     'Суммарное время отрисовки ответов.'),
+    ('response_bytes_total', 'counter', 'Суммарный размер ответов.'),
+)
+
+
+class RequestStats:
+    """Счётчики запросов одного представления в памяти процесса."""
+    __slots__ = ('requests', 'duration', 'queries', 'db_duration',
+                 'serialize_duration', 'render_duration', 'response_bytes')
+
+    def __init__(self):
+        self.requests = 0
+        self.duration = 0.0
+        self.queries = 0
+        self.db_duration = 0.0
+        self.serialize_duration = 0.0
+        self.render_duration = 0.0
+        self.response_bytes = 0
+
+    def values(self):
+        return (self.requests, self.duration, self.queries, self.db_duration,
+                self.serialize_duration, self.render_duration,
+                self.response_bytes)
+
+
+_stats = defaultdict(RequestStats)
+_stats_lock = Lock()
+
+
+class QueryRecorder:
+    """Обёртка выполнения SQL, считающая запросы и их время."""
+
+    def __init__(self, keep_statements):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = [] if keep_statements else None
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - started
+            self.count += 1
+            self.duration += duration
+            if self.statements is not None:
+                self.statements.append((sql, duration))
+
+
+class SerializationTimer:
+    """Время сериализации за запрос без SQL-запросов внутри неё.
+
+    Контекстный менеджер, который представления получают через
+    timed_serialization. Вложенные замеры не считаются повторно.
+    """
+    __slots__ = ('recorder', 'duration', 'depth', 'started', 'db_duration')
+
+    def __init__(self, recorder):
+        self.recorder = recorder
+        self.duration = 0.0
+        self.depth = 0
+
+    def __enter__(self):
+        if not self.depth:
+            self.db_duration = self.recorder.duration
+            self.started = time.perf_counter()
+        self.depth += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        self.depth -= 1
+        if not self.depth:
+            self.duration += (time.perf_counter() - self.started
+                              - (self.recorder.duration - self.db_duration))
+
+
+def timed_serialization(request):
+    """Замер сериализации для RequestMetricsMiddleware, если она включена."""
+    return getattr(request, 'serialization_timer', None) or nullcontext()
+
+
+def get_view_name(request):
+    """Имя представления с действием viewset, например RecipeViewSet.list."""
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unresolved'
+    view = getattr(match.func, 'cls', None)
+    if view is None:
+        return match.view_name
+    action = getattr(match.func, 'actions', {}).get(request.method.lower())
+    return f'{view.__name__}.{action}' if action else view.__name__
+
+
+class RequestMetricsMiddleware:
+    """Число и время SQL-запросов, время сериализации, отрисовки и размер
+    ответа.
+
+    Включается переменной окружения REQUEST_METRICS=True. Добавляет
+    заголовок Server-Timing, копит счётчики для metrics_view и при
+    REQUEST_METRICS_TOP_SQL > 0 пишет в лог самые медленные и
+    повторяющиеся запросы.
+    """
+
+    def __init__(self, get_response):
+        if not settings.REQUEST_METRICS:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.top_sql = settings.REQUEST_METRICS_TOP_SQL
+
+    def __call__(self, request):
+        recorder = QueryRecorder(keep_statements=self.top_sql > 0)
+        timer = request.serialization_timer = SerializationTimer(recorder)
+        started = time.perf_counter()
+        with self.wrap_connections(recorder):
+            response = self.get_response(request)
+        duration = time.perf_counter() - started
+        render_duration = getattr(response, 'render_duration', 0.0)
+        size = 0 if response.streaming else len(response.content)
+        view = get_view_name(request)
+        with _stats_lock:
+            stats = _stats[(view, request.method, response.status_code)]
+            stats.requests += 1
+            stats.duration += duration
+            stats.queries += recorder.count
+            stats.db_duration += recorder.duration
+            stats.serialize_duration += timer.duration
+            stats.render_duration += render_duration
+            stats.response_bytes += size
+        app_duration = (duration - recorder.duration - timer.duration
+                        - render_duration)
+        response['Server-Timing'] = ', '.join((
+            f'db;dur={recorder.duration * 1000:.1f};'
+            f'desc="{recorder.count} queries"',
+            f'app;dur={app_duration * 1000:.1f}',
+            f'serialize;dur={timer.duration * 1000:.1f}',
+            f'render;dur={render_duration * 1000:.1f}',
+            f'total;dur={duration * 1000:.1f}',
+        ))
+        if recorder.statements:
+            self.log_statements(view, recorder.statements)
+        return response
+
+    def process_template_response(self, request, response):
+        """Засекает отрисовку ответа DRF, которая идёт после представления."""
+        started = time.perf_counter()
+
+        def stop(response):
+            response.render_duration = time.perf_counter() - started
+
+        response.add_post_render_callback(stop)
+        return response
+
+    @staticmethod
+    def wrap_connections(recorder):
+        stack = ExitStack()
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(recorder))
+        return stack
+
+    def log_statements(self, view, statements):
+        slowest = sorted(statements, key=lambda item: item[1],
+                         reverse=True)[:self.top_sql]
+        duplicates = [(sql, count) for sql, count in Counter(
+            sql for sql, _ in statements).most_common(self.top_sql)
+            if count > 1]
+        for sql, duration in slowest:
+            logger.info('%s: медленный запрос %.1f мс: %s',
+                        view, duration * 1000, sql)
+        for sql, count in duplicates:
+            logger.info('%s: запрос повторён %d раз: %s', view, count, sql)
+
+
+def format_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"')
+
+
+def metrics_view(request):
+    """Счётчики запросов процесса в текстовом формате Prometheus."""
+    token = settings.REQUEST_METRICS_TOKEN
+    authorization = request.META.get('HTTP_AUTHORIZATION', '')
+    if not (settings.REQUEST_METRICS and token and constant_time_compare(
+            authorization, f'Bearer {token}')):
+        raise Http404
+    with _stats_lock:
+        rows = [(key, stats.values()) for key, stats in _stats.items()]
+    lines = []
+    pid = os.getpid()
+    for position, (name, kind, description) in enumerate(METRICS):
+        lines.append(f'# HELP foodgram_{name} {description}')
+        lines.append(f'# TYPE foodgram_{name} {kind}')
+        for (view, method, status), values in rows:
+            lines.append(
+                f'foodgram_{name}{{view="{format_label(view)}",'
+                f'method="{method}",status="{status}",pid="{pid}"}} '
+                f'{values[position]}')
+    cache_stats = get_response_cache_stats()
+    lines.append('# HELP foodgram_response_cache_total '
+                 'Попадания и промахи кэша ответов.')
+    lines.append('# TYPE foodgram_response_cache_total counter')
+    for result, value in cache_stats.items():
+        lines.append(
+            f'foodgram_response_cache_total{{result="{result}"}} {value}')
+    return HttpResponse('\n'.join(lines) + '\n',
+                        content_type='text/plain; version=0.0.4')
@@ -1,7 +1,225 @@
+import binascii
+import json
+from base64 import b64decode, b64encode
+from collections import OrderedDict
+from functools import partial
+from hashlib import md5
+
+from django.core.cache import cache
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.paginator import EmptyPage, Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import NotFound
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from recipes.versions import RECIPE_LIST_VERSION_KEY, get_version
 
 
-class Pagination(PageNumberPagination):
-    """Пагинация для рецептов и пользователей."""
+class PagePagination(PageNumberPagination):
+    """Постраничная пагинация, в том числе готовых списков."""
     page_size_query_param = 'limit'
     page_size = 6
+
+
+class Pagination(PagePagination):
+    """Пагинация для рецептов и пользователей.
+
+    По умолчанию постраничная, с параметром cursor переходит на ключевую
+    пагинацию по паре (поле сортировки, id) без COUNT и OFFSET.
+    """
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Неверный курсор.'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor_mode = self.cursor_query_param in request.query_params
+        if not self.cursor_mode:
+            return super().paginate_queryset(queryset, request, view)
+        self.request = request
+        page_size = self.get_page_size(request)
+        field = (queryset.query.order_by or queryset.model._meta.ordering)[0]
+        self.descending = field.startswith('-')
+        self.field = field.lstrip('-')
+        cursor = self.decode_cursor(
+            request.query_params[self.cursor_query_param], queryset)
+        backwards = False
+        if cursor is not None:
+            value, pk, backwards = cursor
+            queryset = queryset.filter(self.get_seek_filter(
+                value, pk, backwards != self.descending))
+        ordering = (self.field, 'pk')
+        if backwards != self.descending:
+            ordering = (f'-{self.field}', '-pk')
+        page = list(queryset.order_by(*ordering)[:page_size + 1])
+        has_more = len(page) > page_size
+        page = page[:page_size]
+        if backwards:
+            page.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, cursor is not None
+        self.page = page
+        return page
+
+    def get_seek_filter(self, value, pk, reverse):
+        """Условие для строк после ключа (value, pk)."""
+        if reverse:
+            return (Q(**{f'{self.field}__lte': value})
+                    & (Q(**{f'{self.field}__lt': value}) | Q(pk__lt=pk)))
+        return (Q(**{f'{self.field}__gte': value})
+                & (Q(**{f'{self.field}__gt': value}) | Q(pk__gt=pk)))
+
+    def get_cursor_field(self, queryset):
+        """Поле модели или аннотация, по которой идёт сортировка."""
+        try:
+            return queryset.model._meta.get_field(self.field)
+        except FieldDoesNotExist:
+            annotation = queryset.query.annotations.get(self.field)
+            return annotation.output_field if annotation else None
+
+    def decode_cursor(self, encoded, queryset):
+        """Ключ (значение, id, назад) из курсора.
+
+        Курсор приходит от клиента, поэтому значение приводится к типу
+        поля сортировки, а id должен быть целым числом.
+        """
+        if not encoded:
+            return None
+        try:
+            value, pk, backwards = json.loads(b64decode(encoded.encode()))
+            if (type(pk) is not int or abs(pk) >= 2 ** 63
+                    or type(value) not in (str, int, float)
+                    or type(backwards) is not bool):
+                raise ValueError
+            field = self.get_cursor_field(queryset)
+            if field is not None:
+                value = field.to_python(value)
+        except (TypeError, ValueError, binascii.Error, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        return value, pk, backwards
+
+    def encode_cursor(self, obj, backwards):
+        cursor = json.dumps(
+            [getattr(obj, self.field), obj.pk, backwards], default=str)
+        return b64encode(cursor.encode()).decode()
+
+    def get_cursor_link(self, obj, backwards):
+        url = self.request.build_absolute_uri()
+        url = remove_query_param(url, self.page_query_param)
+        return replace_query_param(url, self.cursor_query_param,
+                                   self.encode_cursor(obj, backwards))
+
+    def get_paginated_response(self, data):
+        if not self.cursor_mode:
+            return super().get_paginated_response(data)
+        return Response(OrderedDict([
+            ('next', self.get_cursor_link(self.page[-1], False)
+             if self.has_next and self.page else None),
+            ('previous', self.get_cursor_link(self.page[0], True)
+             if self.has_previous and self.page else None),
+            ('results', data),
+        ]))
+
+
+class CountingPaginator(Paginator):
+    """Paginator с заранее посчитанным количеством объектов.
+
+    Оценочное количество (estimated) не ограничивает номер страницы:
+    страница читается с одной лишней строкой, и по ней количество
+    уточняется, чтобы страницы и ссылка next доходили до настоящего
+    конца списка.
+    """
+
+    def __init__(self, object_list, per_page, count, estimated=False,
+                 **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.count = count
+        self.estimated = estimated
+
+    def validate_number(self, number):
+        try:
+            return super().validate_number(number)
+        except EmptyPage:
+            if not self.estimated or int(number) < 1:
+                raise
+            return int(number)
+
+    def page(self, number):
+        if not self.estimated:
+            return super().page(number)
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        rows = list(self.object_list[bottom:bottom + self.per_page + 1])
+        if not rows and number > 1:
+            raise EmptyPage(_('That page contains no results'))
+        if len(rows) > self.per_page:
+            self.count = max(self.count, bottom + len(rows))
+        else:
+            self.count = bottom + len(rows)
+        self.__dict__.pop('num_pages', None)
+        return self._get_page(rows[:self.per_page], number, self)
+
+
+class ApproximateCountPagination(Pagination):
+    """Пагинация с дешёвым подсчётом количества для больших списков.
+
+    Ниже порога count_threshold количество точное, выше - оценка
+    планировщика PostgreSQL, которая уточняется по прочитанной странице.
+    Результат кэшируется по нормализованным параметрам фильтров до
+    изменения рецептов или тегов. Параметр count=exact всегда
+    запрашивает точное количество.
+    """
+    count_query_param = 'count'
+    count_threshold = 1000
+    count_cache_timeout = 60 * 60
+    personal_query_params = ('is_favorited', 'is_in_shopping_cart')
+    ignored_query_params = ('page', 'limit', 'cursor', 'count', 'format')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.cursor_query_param not in request.query_params:
+            count, estimated = self.get_count(queryset, request)
+            self.django_paginator_class = partial(
+                CountingPaginator, count=count, estimated=estimated)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_count(self, queryset, request):
+        """Количество объектов и признак того, что это оценка."""
+        params = request.query_params
+        if (params.get(self.count_query_param) == 'exact'
+                or any(params.get(param) not in (None, '', '0', 'false')
+                       for param in self.personal_query_params)):
+            return queryset.count(), False
+        key = self.get_count_cache_key(queryset, request)
+        result = cache.get(key)
+        if result is None:
+            count = self.estimate_count(queryset)
+            if count is None or count < self.count_threshold:
+                result = queryset.count(), False
+            else:
+                result = count, True
+            cache.set(key, result, self.count_cache_timeout)
+        return result
+
+    def get_count_cache_key(self, queryset, request):
+        params = sorted(
+            (name, sorted(request.query_params.getlist(name)))
+            for name in request.query_params
+            if name not in self.ignored_query_params)
+        return 'api:counts:{}:{}:{}'.format(
+            get_version(RECIPE_LIST_VERSION_KEY),
+            queryset.model._meta.label_lower,
+            md5(repr(params).encode()).hexdigest())
+
+    def estimate_count(self, queryset):
+        """Оценка количества строк планировщиком PostgreSQL."""
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql':
+            return None
+        sql, params = queryset.order_by().query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+            plan = cursor.fetchone()[0]
+        return int(plan[0]['Plan']['Plan Rows'])
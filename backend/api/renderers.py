@@ -0,0 +1,185 @@
+import csv
+import json
+import math
+import re
+from io import BytesIO
+
+from django.conf import settings
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+PDF_CHUNK_SIZE = 64 * 1024
+# После замены по таблице и удаления цифр и минуса дробное число,
+# например :1.5e-7, превращается в Se. Так быстро проверяется, есть ли
+# в ответе дробные числа вообще.
+FLOAT_TABLE = bytes(
+    ord('S') if byte in b':,[' else ord('e') if byte in b'.e' else ord('x')
+    for byte in range(256))
+# Числа, которые orjson записывает не так, как json: с экспонентой
+# или вида 0.00001, для которого json выбирает 1e-05.
+ORJSON_MISMATCHED_NUMBER = re.compile(
+    rb'(?:^|[:,\[])-?(?:\d+(?:\.\d+)?e|0\.0000)')
+
+
+def has_mismatched_numbers(content):
+    """Есть ли в ответе orjson числа, которые json записал бы иначе."""
+    return (b'Se' in (b'[' + content).translate(FLOAT_TABLE, b'0123456789-')
+            and ORJSON_MISMATCHED_NUMBER.search(content) is not None)
+
+
+def has_non_finite_numbers(data):
+    """Есть ли в данных NaN или бесконечность: orjson пишет их как null."""
+    stack = [data]
+    pop, extend = stack.pop, stack.extend
+    while stack:
+        value = pop()
+        cls = type(value)
+        if cls is str or cls is int or value is None:
+            continue
+        if isinstance(value, dict):
+            extend(value.values())
+        elif isinstance(value, (list, tuple)):
+            extend(value)
+        elif isinstance(value, float) and not math.isfinite(value):
+            return True
+    return False
+
+
+class FastJSONRenderer(JSONRenderer):
+    """JSONRenderer на orjson, если он установлен.
+
+    Ответ совпадает с JSONRenderer байт в байт: даты, Decimal, ленивые
+    строки и прочие типы, которых orjson не знает, преобразует тот же
+    JSONEncoder DRF. Если orjson не справился, встретил число, которое
+    json записал бы иначе, или нужен отступ или ASCII, ответ собирает
+    обычный JSONRenderer. Он же отвечает за NaN и бесконечность, которые
+    orjson молча записал бы как null, а при STRICT_JSON выдаёт на них
+    ошибку. Данные на них проверяются, только если в ответе есть null.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (orjson is None or data is None or self.ensure_ascii
+                or not self.compact
+                or self.get_indent(accepted_media_type or '',
+                                   renderer_context or {})):
+            return super().render(data, accepted_media_type,
+                                  renderer_context)
+        encode = self.encoder_class().default
+
+        def default(value):
+            value = encode(value)
+            if isinstance(value, float) and not math.isfinite(value):
+                raise TypeError(value)
+            return value
+
+        try:
+            content = orjson.dumps(data, default=default,
+                                   option=orjson.OPT_PASSTHROUGH_DATETIME)
+        except orjson.JSONEncodeError:
+            content = None
+        if (content is None or has_mismatched_numbers(content)
+                or b'null' in content and has_non_finite_numbers(data)):
+            return super().render(data, accepted_media_type,
+                                  renderer_context)
+        return content.replace(b'\xe2\x80\xa8', b'\\u2028').replace(
+            b'\xe2\x80\xa9', b'\\u2029')
+
+
+class EchoBuffer:
+    """Буфер, который сразу возвращает записанную строку."""
+
+    def write(self, value):
+        return value
+
+
+class ShoppingListRenderer(BaseRenderer):
+    """Базовый рендерер для выгрузки списка покупок."""
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        """Отображение ошибок, сам список выгружается через stream."""
+        return json.dumps(data, ensure_ascii=False).encode('utf-8')
+
+    def stream(self, ingredients):
+        raise NotImplementedError
+
+
+class ShoppingListTextRenderer(ShoppingListRenderer):
+    """Список покупок в виде текстового файла."""
+    media_type = 'text/plain'
+    format = 'txt'
+
+    def stream(self, ingredients):
+        yield 'Ваш список покупок:\n'
+        for ingredient in ingredients:
+            yield (f'{ingredient["name"]} - {ingredient["amount"]} '
+                   f'({ingredient["measurement_unit"]}).\n')
+
+
+class ShoppingListCSVRenderer(ShoppingListRenderer):
+    """Список покупок в формате CSV."""
+    media_type = 'text/csv'
+    format = 'csv'
+
+    def stream(self, ingredients):
+        writer = csv.writer(EchoBuffer())
+        yield writer.writerow(
+            ('Ингредиент', 'Количество', 'Единицы измерения'))
+        for ingredient in ingredients:
+            yield writer.writerow((ingredient['name'], ingredient['amount'],
+                                   ingredient['measurement_unit']))
+
+
+class ShoppingListJSONRenderer(ShoppingListRenderer):
+    """Список покупок в формате JSON."""
+    media_type = 'application/json'
+    format = 'json'
+
+    def stream(self, ingredients):
+        separator = '['
+        for ingredient in ingredients:
+            yield separator + json.dumps({
+                'name': ingredient['name'],
+                'measurement_unit': ingredient['measurement_unit'],
+                'amount': ingredient['amount'],
+            }, ensure_ascii=False)
+            separator = ','
+        yield '[]' if separator == '[' else ']'
+
+
+class ShoppingListPDFRenderer(ShoppingListRenderer):
+    """Список покупок в формате PDF."""
+    media_type = 'application/pdf'
+    format = 'pdf'
+    charset = None
+
+    def stream(self, ingredients):
+        pdfmetrics.registerFont(
+            TTFont('ShoppingList', settings.SHOPPING_LIST_PDF_FONT))
+        buffer = BytesIO()
+        pdf = canvas.Canvas(buffer, pagesize=A4)
+        top = A4[1] - 50
+        y = top
+        pdf.setFont('ShoppingList', 16)
+        pdf.drawString(50, y, 'Ваш список покупок:')
+        pdf.setFont('ShoppingList', 12)
+        for ingredient in ingredients:
+            y -= 20
+            if y < 50:
+                pdf.showPage()
+                pdf.setFont('ShoppingList', 12)
+                y = top
+            pdf.drawString(50, y, (
+                f'{ingredient["name"]} - {ingredient["amount"]} '
+                f'({ingredient["measurement_unit"]}).'))
+        pdf.save()
+        buffer.seek(0)
+        yield from iter(lambda: buffer.read(PDF_CHUNK_SIZE), b'')
@@ -1,17 +1,54 @@
 from django.contrib.auth.password_validation import validate_password
+from django.db import transaction
 from drf_base64.fields import Base64ImageField
 from rest_framework import serializers
 
+from .fields import ContentHashImageField, ImageVariantsField
+from recipes.catalog import get_catalog
+from recipes.counters import change_counter
+from recipes.documents import ensure_documents
+from recipes.images import schedule_recipe_variants
 from recipes.models import (Favourites, Ingredient, Recipe, RecipeIngredient,
-                            ShoppingCart, Tag)
+                            ShoppingCart, ShoppingListItem, Tag)
+from recipes.pantry import record_pantry_change
 from users.models import Subscriber, User
 
 
+def get_missing_ids(catalog_index, pks):
+    """Первичные ключи, которых нет в снимке справочника"""
+    index = getattr(get_catalog(), catalog_index)
+    return sorted({pk for pk in pks if pk not in index})
+
+
+class CatalogPrimaryKeyListField(serializers.ListField):
+    """Список первичных ключей, проверяемых по снимку справочника"""
+    child = serializers.IntegerField()
+    default_error_messages = {
+        'does_not_exist': ('Недопустимые первичные ключи {pk_values} - '
+                           'объекты не существуют.'),
+    }
+
+    def __init__(self, catalog_index, **kwargs):
+        self.catalog_index = catalog_index
+        super().__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        pks = super().to_internal_value(data)
+        missing = get_missing_ids(self.catalog_index, pks)
+        if missing:
+            self.fail('does_not_exist',
+                      pk_values=', '.join(map(str, missing)))
+        return pks
+
+
 class BaseSubscriptionSerializer(serializers.ModelSerializer):
     """Базовый сериализатор для подписок с общей логикой"""
 
     def get_is_subscribed(self, obj):
         """Проверка подписки"""
+        is_subscribed = getattr(obj, 'is_subscribed', None)
+        if is_subscribed is not None:
+            return is_subscribed
         request = self.context.get('request')
         if request and not request.user.is_anonymous:
             return Subscriber.objects.filter(user=request.user,
@@ -22,19 +59,27 @@ class BaseSubscriptionSerializer(serializers.ModelSerializer):
 class BaseRecipeSerializer(serializers.ModelSerializer):
     """Базовый сериализатор для рецептов с общей логикой"""
 
-    def check_recipe_status(self, obj, model):
-        """Проверка, находится ли рецепт в модели"""
+    def check_recipe_status(self, obj, model, field):
+        """Проверка, находится ли рецепт в модели.
+
+        Использует аннотацию из RecipeViewSet.get_queryset, а запрос
+        выполняет только для рецептов, загруженных в обход неё.
+        """
+        status = getattr(obj, field, None)
+        if status is not None:
+            return status
         user = self.context['request'].user
         return (model.objects.filter(user=user, recipe=obj)
                 .exists()) if user.is_authenticated else False
 
     def get_is_in_shopping_cart(self, obj):
         """Проверка, находится ли рецепт в списке покупок"""
-        return self.check_recipe_status(obj, ShoppingCart)
+        return self.check_recipe_status(obj, ShoppingCart,
+                                        'is_in_shopping_cart')
 
     def get_is_favorited(self, obj):
         """Проверка, является ли рецепт избранным"""
-        return self.check_recipe_status(obj, Favourites)
+        return self.check_recipe_status(obj, Favourites, 'is_favorited')
 
 
 class UserSerializer(BaseSubscriptionSerializer):
@@ -72,15 +117,17 @@ class PasswordSerializer(serializers.Serializer):
 
 class ShortRecipeSerializer(serializers.ModelSerializer):
     """Вспомогательный сериализатор для рецептов"""
+    image_variants = ImageVariantsField()
+
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'image_variants', 'cooking_time')
 
 
 class SubscriptionsSerializer(BaseSubscriptionSerializer):
     """Сериализатор для подписок текущего пользователя"""
     recipes = serializers.SerializerMethodField()
-    recipes_count = serializers.SerializerMethodField()
+    recipes_count = serializers.IntegerField(read_only=True)
     is_subscribed = serializers.SerializerMethodField()
 
     class Meta:
@@ -92,17 +139,15 @@ class SubscriptionsSerializer(BaseSubscriptionSerializer):
     def get_recipes(self, obj):
         """Возвращает ограниченный список рецептов автора"""
         request = self.context.get('request')
-        limit = request.GET.get('recipes_limit')
-        queryset = obj.recipes.all()
-        if limit:
-            queryset = queryset[:int(limit)]
+        queryset = getattr(obj, 'limited_recipes', None)
+        if queryset is None:
+            queryset = obj.recipes.all()
+            limit = self.context.get('recipes_limit')
+            if limit is not None:
+                queryset = queryset[:limit]
         return ShortRecipeSerializer(queryset, many=True,
                                      context={'request': request}).data
 
-    def get_recipes_count(self, obj):
-        """Возвращает количество рецептов автора"""
-        return obj.recipes.count()
-
     def validate_subscription(self, obj):
         """Запрещает подписку на самого себя"""
         if self.context['request'].user == obj:
@@ -110,6 +155,11 @@ class SubscriptionsSerializer(BaseSubscriptionSerializer):
         return obj
 
 
+class RecipesLimitSerializer(serializers.Serializer):
+    """Сериализатор для параметра recipes_limit"""
+    recipes_limit = serializers.IntegerField(min_value=0, required=False)
+
+
 class SubscriberSerializer(serializers.ModelSerializer):
     """Сериализатор для модели подписок"""
     class Meta:
@@ -159,24 +209,91 @@ class RecipeSerializer(BaseRecipeSerializer):
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
     image = Base64ImageField()
+    image_variants = ImageVariantsField()
 
     class Meta:
         model = Recipe
         fields = ('id', 'tags', 'author', 'ingredients', 'is_favorited',
-                  'is_in_shopping_cart', 'name', 'image', 'text',
-                  'cooking_time')
+                  'is_in_shopping_cart', 'name', 'image', 'image_variants',
+                  'text', 'cooking_time')
 
-    def get_is_favorited(self, obj):
-        return self.check_recipe_status(obj, Favourites)
+    def to_representation(self, instance):
+        """Передаёт автору признак подписки из аннотации рецепта"""
+        is_subscribed = getattr(instance, 'is_author_subscribed', None)
+        if is_subscribed is not None:
+            instance.author.is_subscribed = is_subscribed
+        return super().to_representation(instance)
 
-    def get_is_in_shopping_cart(self, obj):
-        return self.check_recipe_status(obj, ShoppingCart)
+
+class RecipeDocumentSerializer(serializers.BaseSerializer):
+    """Рецепт из готового документа с признаками текущего пользователя
+
+    Ответ совпадает с RecipeSerializer, но без вложенных сериализаторов:
+    документ собирается заранее, а здесь добавляются только признаки
+    избранного, списка покупок и подписки на автора.
+    """
+
+    def absolute_url(self, url):
+        request = self.context.get('request')
+        if url is None or request is None:
+            return url
+        return request.build_absolute_uri(url)
+
+    def to_representation(self, instance):
+        document = instance.read_document
+        author_id, username, first_name, last_name, email, avatar = (
+            document['author'])
+        return {
+            'id': document['id'],
+            'tags': [{'id': tag_id, 'name': name, 'slug': slug}
+                     for tag_id, name, slug in document['tags']],
+            'author': {
+                'id': author_id,
+                'username': username,
+                'first_name': first_name,
+                'last_name': last_name,
+                'email': email,
+                'is_subscribed': instance.is_author_subscribed,
+                'avatar': self.absolute_url(avatar),
+            },
+            'ingredients': [
+                {'id': ingredient_id, 'name': name,
+                 'measurement_unit': measurement_unit, 'amount': amount}
+                for ingredient_id, name, measurement_unit, amount
+                in document['ingredients']
+            ],
+            'is_favorited': instance.is_favorited,
+            'is_in_shopping_cart': instance.is_in_shopping_cart,
+            'name': document['name'],
+            'image': self.absolute_url(document['image']),
+            'image_variants': {
+                file_format: {width: self.absolute_url(url)
+                              for width, url in urls.items()}
+                for file_format, urls in document['image_variants'].items()
+            },
+            'text': document['text'],
+            'cooking_time': document['cooking_time'],
+        }
+
+
+class PantryRecipeSerializer(RecipeSerializer):
+    """Сериализатор рецептов, подобранных по ингредиентам кладовой"""
+    missing_count = serializers.IntegerField(read_only=True)
+
+    class Meta(RecipeSerializer.Meta):
+        fields = RecipeSerializer.Meta.fields + ('missing_count',)
+
+
+class PantrySerializer(serializers.Serializer):
+    """Сериализатор параметров подбора рецептов по кладовой"""
+    ingredients = CatalogPrimaryKeyListField('ingredients_by_id',
+                                             allow_empty=False)
+    max_missing = serializers.IntegerField(min_value=0, default=2)
 
 
 class RecipeWriteIngredientSerializer(serializers.ModelSerializer):
     """Вспомогательный сериализатор для добавления ингредиентов в рецепт"""
-    id = serializers.PrimaryKeyRelatedField(
-        queryset=Ingredient.objects.all())
+    id = serializers.IntegerField()
 
     class Meta:
         model = RecipeIngredient
@@ -187,15 +304,24 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
     """Сериализатор для создания и редактирования рецептов"""
     author = UserSerializer(read_only=True)
     ingredients = RecipeWriteIngredientSerializer(many=True)
-    tags = serializers.PrimaryKeyRelatedField(queryset=Tag.objects.all(),
-                                              many=True)
-    image = Base64ImageField()
+    tags = CatalogPrimaryKeyListField('tags_by_id')
+    image = ContentHashImageField()
 
     class Meta:
         model = Recipe
         fields = ('id', 'name', 'ingredients', 'tags',
                   'image', 'text', 'cooking_time', 'author')
 
+    def validate_ingredients(self, value):
+        """Проверка существования всех ингредиентов разом"""
+        missing = get_missing_ids(
+            'ingredients_by_id', [ingredient['id'] for ingredient in value])
+        if missing:
+            raise serializers.ValidationError(
+                f'Недопустимые ингредиенты {", ".join(map(str, missing))} - '
+                f'объекты не существуют.')
+        return value
+
     def validate(self, data):
         """Валидация на наличие ингредиентов и уникальность"""
         ingredients = data.get('ingredients')
@@ -215,12 +341,40 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
         RecipeIngredient.objects.bulk_create([
             RecipeIngredient(
                 recipe=recipe,
-                ingredients=ingredient_data['id'],
+                ingredients_id=ingredient_data['id'],
                 amount=ingredient_data['amount']
             )
             for ingredient_data in ingredients
         ])
 
+    def update_ingredients(self, recipe, ingredients):
+        """Применение к ингредиентам рецепта только изменений"""
+        existing = {item.ingredients_id: item
+                    for item in recipe.recipeingredients.all()}
+        old_amounts = {ingredient_id: item.amount
+                       for ingredient_id, item in existing.items()}
+        new_amounts = {ingredient_data['id']: ingredient_data['amount']
+                       for ingredient_data in ingredients}
+        removed = old_amounts.keys() - new_amounts.keys()
+        if removed:
+            recipe.recipeingredients.filter(ingredients__in=removed).delete()
+        changed = []
+        for ingredient_id, item in existing.items():
+            amount = new_amounts.get(ingredient_id)
+            if amount is not None and amount != item.amount:
+                item.amount = amount
+                changed.append(item)
+        RecipeIngredient.objects.bulk_update(changed, ['amount'])
+        self.set_ingredients(recipe, [
+            ingredient_data for ingredient_data in ingredients
+            if ingredient_data['id'] not in existing
+        ])
+        ShoppingListItem.objects.change_recipe(recipe, old_amounts,
+                                               new_amounts)
+        if old_amounts.keys() != new_amounts.keys():
+            record_pantry_change(recipe.id)
+
+    @transaction.atomic
     def create(self, validated_data):
         """Создание нового рецепта"""
         request = self.context.get('request')
@@ -231,18 +385,26 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
                                        **validated_data)
         self.set_ingredients(recipe, ingredients)
         self.set_tags(recipe, tags)
+        record_pantry_change(recipe.id)
+        change_counter(User, author.id, 'recipes_count', 1)
+        schedule_recipe_variants(recipe.id)
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         """Обновление существующего рецепта"""
         ingredients = validated_data.pop('ingredients', None)
         tags = validated_data.pop('tags', None)
+        if 'image' in validated_data:
+            validated_data['image_variants'] = {}
+            schedule_recipe_variants(instance.id)
 
-        instance = super().update(instance, validated_data)
+        for attr, value in validated_data.items():
+            setattr(instance, attr, value)
+        instance.save(update_fields=[*validated_data, 'updated_at'])
 
         if ingredients is not None:
-            instance.ingredients.clear()
-            self.set_ingredients(instance, ingredients)
+            self.update_ingredients(instance, ingredients)
 
         if tags is not None:
             self.set_tags(instance, tags)
@@ -251,7 +413,10 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
 
     def to_representation(self, instance):
         """Корректное отображение созданного/обновленного рецепта"""
-        return RecipeSerializer(instance, context=self.context).data
+        instance = Recipe.objects.for_documents(
+            self.context['request'].user).get(pk=instance.pk)
+        ensure_documents([instance])
+        return RecipeDocumentSerializer(instance, context=self.context).data
 
 
 class ShoppingCartModelSerializer(serializers.ModelSerializer):
@@ -270,8 +435,14 @@ class FavoriteRecipeSerializer(serializers.ModelSerializer):
 
 class AvatarSerializer(serializers.ModelSerializer):
     """Сериализатор для аватара"""
-    avatar = Base64ImageField()
+    avatar = ContentHashImageField()
 
     class Meta:
         model = User
         fields = ('avatar',)
+
+    def update(self, instance, validated_data):
+        """Сохраняет только аватар, не затирая счётчики пользователя"""
+        instance.avatar = validated_data['avatar']
+        instance.save(update_fields=['avatar'])
+        return instance
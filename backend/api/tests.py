@@ -0,0 +1,476 @@
+import json
+import os
+import tempfile
+from base64 import b64encode, encodebytes
+from decimal import Decimal
+from io import BytesIO
+from unittest import mock
+
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import ValidationError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.serializers import BaseSerializer
+from rest_framework.test import APIClient
+
+from .caches import get_response_cache_stats
+from .fields import DECODE_CHUNK_SIZE, ContentHashImageField
+from .paginations import ApproximateCountPagination
+from .renderers import FastJSONRenderer
+from recipes.catalog import get_catalog
+from recipes.documents import build_documents
+from recipes.models import (Favourites, Ingredient, Recipe, RecipeIngredient,
+                            ShoppingCart, Tag)
+from recipes.pantry import build_pantry_index, record_pantry_change
+from users.models import Subscriber, User
+
+TEST_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'api-tests',
+    },
+    'responses': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'api-tests-responses',
+    },
+}
+DRF_SERIALIZER_DATA = BaseSerializer.__dict__['data']
+# Количество в списке рецептов: на PostgreSQL сначала оценка планировщика.
+COUNT_QUERIES = 2 if connection.vendor == 'postgresql' else 1
+
+
+@override_settings(CACHES=TEST_CACHES)
+class RecipeAPITestCase(TestCase):
+    """Рецепты с тегами, ингредиентами и отметками пользователя."""
+    recipes_count = 12
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(
+            username='reader', email='reader@example.com',
+            first_name='Читатель', last_name='Рецептов')
+        cls.author = User.objects.create(
+            username='author', email='author@example.com',
+            first_name='Автор', last_name='Рецептов')
+        Subscriber.objects.create(user=cls.user, author=cls.author)
+        tags = [Tag.objects.create(name=f'Тег {number}', slug=f'tag-{number}')
+                for number in range(3)]
+        ingredients = [
+            Ingredient.objects.create(name=f'Ингредиент {number}',
+                                      measurement_unit='г')
+            for number in range(5)
+        ]
+        cls.recipes = [
+            Recipe.objects.create(
+                author=cls.author, name=f'Рецепт {number:02}',
+                text='Описание', cooking_time=10,
+                image='recipes_images/test.png')
+            for number in range(cls.recipes_count)
+        ]
+        for recipe in cls.recipes:
+            recipe.tags.set(tags)
+            RecipeIngredient.objects.bulk_create(
+                RecipeIngredient(recipe=recipe, ingredients=ingredient,
+                                 amount=100)
+                for ingredient in ingredients)
+        Favourites.objects.create(user=cls.user, recipe=cls.recipes[0])
+        ShoppingCart.objects.create(user=cls.user, recipe=cls.recipes[1])
+        cls.token = Token.objects.create(user=cls.user)
+
+    def setUp(self):
+        for cache in caches.all():
+            cache.clear()
+        build_documents([recipe.id for recipe in self.recipes])
+        get_catalog()
+        self.anonymous = APIClient()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token}')
+
+
+class RecipeReadQueriesTest(RecipeAPITestCase):
+    """Число запросов при чтении рецептов не зависит от их количества."""
+
+    def test_anonymous_list(self):
+        with self.assertNumQueries(COUNT_QUERIES + 1):
+            response = self.anonymous.get('/api/recipes/', {'limit': 10})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 10)
+
+    def test_authenticated_list(self):
+        with self.assertNumQueries(COUNT_QUERIES + 2):
+            response = self.client.get('/api/recipes/', {'limit': 10})
+        self.assertEqual(response.status_code, 200)
+        results = {recipe['id']: recipe
+                   for recipe in response.data['results']}
+        self.assertTrue(results[self.recipes[0].id]['is_favorited'])
+        self.assertTrue(results[self.recipes[1].id]['is_in_shopping_cart'])
+        self.assertTrue(results[self.recipes[0].id]['author']['is_subscribed'])
+
+    def test_anonymous_retrieve(self):
+        with self.assertNumQueries(1):
+            response = self.anonymous.get(
+                f'/api/recipes/{self.recipes[0].id}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['ingredients']), 5)
+
+    def test_authenticated_retrieve(self):
+        with self.assertNumQueries(2):
+            response = self.client.get(f'/api/recipes/{self.recipes[0].id}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['is_favorited'])
+        self.assertTrue(response.data['author']['is_subscribed'])
+
+
+class RecipeConditionalGetTest(RecipeAPITestCase):
+    """Ответ 304 на повторный запрос и новый ETag после изменений."""
+
+    def get_etag(self, client, path):
+        response = client.get(path)
+        self.assertEqual(response.status_code, 200)
+        return response['ETag']
+
+    def assert_not_modified(self, client, path):
+        etag = self.get_etag(client, path)
+        response = client.get(path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_anonymous_not_modified(self):
+        self.assert_not_modified(self.anonymous, '/api/recipes/')
+        self.assert_not_modified(self.anonymous,
+                                 f'/api/recipes/{self.recipes[0].id}/')
+
+    def test_authenticated_not_modified(self):
+        self.assert_not_modified(self.client, '/api/recipes/')
+        self.assert_not_modified(self.client,
+                                 f'/api/recipes/{self.recipes[0].id}/')
+
+    def test_etag_changes_after_favorite(self):
+        recipe = self.recipes[2]
+        path = f'/api/recipes/{recipe.id}/'
+        etag = self.get_etag(self.client, path)
+        list_etag = self.get_etag(self.client, '/api/recipes/')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(f'{path}favorite/')
+        self.assertEqual(response.status_code, 201)
+        response = self.client.get(path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertTrue(response.data['is_favorited'])
+        response = self.client.get('/api/recipes/',
+                                   HTTP_IF_NONE_MATCH=list_etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_etag_changes_after_recipe_edit(self):
+        recipe = self.recipes[0]
+        path = f'/api/recipes/{recipe.id}/'
+        etags = {client: self.get_etag(client, path)
+                 for client in (self.anonymous, self.client)}
+        author = APIClient()
+        author.force_authenticate(self.author)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = author.patch(path, {
+                'name': 'Новое название',
+                'ingredients': [{'id': item.ingredients_id, 'amount': 50}
+                                for item in recipe.recipeingredients.all()],
+            }, format='json')
+        self.assertEqual(response.status_code, 200)
+        for client, etag in etags.items():
+            response = client.get(path, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response['ETag'], etag)
+            self.assertEqual(response.data['name'], 'Новое название')
+
+
+class RecipeCursorPaginationTest(RecipeAPITestCase):
+    """Ключевая пагинация и курсоры, подделанные клиентом."""
+
+    def test_pages_follow_cursor(self):
+        response = self.anonymous.get('/api/recipes/',
+                                      {'cursor': '', 'limit': 5})
+        self.assertEqual(response.status_code, 200)
+        names = [recipe['name'] for recipe in response.data['results']]
+        response = self.anonymous.get(response.data['next'])
+        self.assertEqual(response.status_code, 200)
+        names += [recipe['name'] for recipe in response.data['results']]
+        self.assertEqual(names, sorted(
+            recipe.name for recipe in self.recipes)[:10])
+
+    def test_invalid_cursor(self):
+        cursors = ['не base64', '!!!', b64encode(b'{').decode()] + [
+            b64encode(json.dumps(cursor).encode()).decode()
+            for cursor in ([{}, {}, 0], ['a', 'x', 0], ['a', 1],
+                           [None, 1, False], ['a', 1.5, False],
+                           ['a', True, False], ['a', 2 ** 70, False],
+                           [['a'], 1, False], ['a', 1, 'x'])
+        ]
+        for cursor in cursors:
+            with self.subTest(cursor=cursor):
+                response = self.anonymous.get('/api/recipes/',
+                                              {'cursor': cursor})
+                self.assertEqual(response.status_code, 404)
+
+
+class RecipeWriteFiltersTest(RecipeAPITestCase):
+    """Изменение рецепта с фильтрами пользователя в строке запроса."""
+
+    def setUp(self):
+        super().setUp()
+        Favourites.objects.create(user=self.author, recipe=self.recipes[0])
+        ShoppingCart.objects.create(user=self.author, recipe=self.recipes[1])
+        self.author_client = APIClient()
+        self.author_client.force_authenticate(self.author)
+
+    def test_patch_with_is_favorited(self):
+        for recipe, status_code in ((self.recipes[0], 200),
+                                    (self.recipes[2], 404)):
+            with self.subTest(recipe=recipe.name):
+                response = self.author_client.patch(
+                    f'/api/recipes/{recipe.id}/?is_favorited=1', {
+                        'name': 'Новое название',
+                        'ingredients': [
+                            {'id': item.ingredients_id, 'amount': 50}
+                            for item in recipe.recipeingredients.all()],
+                    }, format='json')
+                self.assertEqual(response.status_code, status_code)
+
+    def test_delete_with_is_in_shopping_cart(self):
+        for recipe, status_code in ((self.recipes[2], 404),
+                                    (self.recipes[1], 204)):
+            with self.subTest(recipe=recipe.name):
+                response = self.author_client.delete(
+                    f'/api/recipes/{recipe.id}/?is_in_shopping_cart=1')
+                self.assertEqual(response.status_code, status_code)
+
+
+class RecipeCountCacheTest(RecipeAPITestCase):
+    """Закэшированное количество рецептов в списке с фильтрами."""
+
+    def test_count_follows_recipe_edit(self):
+        params = {'search': 'Уникальное'}
+        self.assertEqual(
+            self.client.get('/api/recipes/', params).data['count'], 0)
+        recipe = self.recipes[0]
+        recipe.name = 'Уникальное название'
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe.save(update_fields=['name', 'updated_at'])
+        self.assertEqual(
+            self.client.get('/api/recipes/', params).data['count'], 1)
+
+
+class RecipeApproximateCountTest(RecipeAPITestCase):
+    """Оценка количества не обрезает список и не ломает ссылку next."""
+
+    def get_pages(self, estimate):
+        with mock.patch.object(ApproximateCountPagination,
+                               'count_threshold', 1), \
+                mock.patch.object(ApproximateCountPagination,
+                                  'estimate_count', return_value=estimate):
+            return [self.client.get('/api/recipes/',
+                                    {'limit': 5, 'page': page})
+                    for page in range(1, 6)]
+
+    def assert_pages(self, pages):
+        self.assertEqual([page.status_code for page in pages],
+                         [200, 200, 200, 404, 404])
+        names = [recipe['name'] for page in pages[:3]
+                 for recipe in page.data['results']]
+        self.assertEqual(names, sorted(recipe.name
+                                       for recipe in self.recipes))
+        self.assertIsNotNone(pages[1].data['next'])
+        self.assertIsNone(pages[2].data['next'])
+        self.assertEqual(pages[2].data['count'], self.recipes_count)
+
+    def test_estimate_too_low(self):
+        self.assert_pages(self.get_pages(3))
+
+    def test_estimate_too_high(self):
+        self.assert_pages(self.get_pages(1000))
+
+
+class RecipeResponseCacheTest(RecipeAPITestCase):
+    """Кэш ответов анонимным пользователям и изменения пользователей."""
+
+    def get_list(self):
+        response = self.anonymous.get('/api/recipes/')
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_signup_keeps_cached_lists(self):
+        self.get_list()
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.anonymous.post('/api/users/', {
+                'email': 'new@example.com', 'username': 'newcomer',
+                'first_name': 'Новый', 'last_name': 'Пользователь',
+                'password': 'Zx9!long-password',
+            }, format='json')
+        self.assertEqual(response.status_code, 201)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.set_password('Zx9!another-password')
+            self.user.save(update_fields=['password'])
+        self.get_list()
+        self.assertEqual(get_response_cache_stats(),
+                         {'hits': 1, 'misses': 1})
+
+    def test_author_card_change_resets_cached_lists(self):
+        self.get_list()
+        self.author.first_name = 'Переименованный'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.author.save(update_fields=['first_name'])
+        response = self.get_list()
+        self.assertEqual(get_response_cache_stats(),
+                         {'hits': 0, 'misses': 2})
+        self.assertEqual(response.data['results'][0]['author']['first_name'],
+                         'Переименованный')
+
+
+class PantrySearchTest(RecipeAPITestCase):
+    """Подбор рецептов по кладовой из построенного заранее индекса."""
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = self.settings(PANTRY_INDEX_PATH=os.path.join(
+            directory.name, 'pantry.npz'))
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.ingredients = list(Ingredient.objects.order_by('id'))
+
+    def search(self, ingredients, max_missing=0):
+        return self.anonymous.get('/api/recipes/pantry/', {
+            'ingredients': [ingredient.id for ingredient in ingredients],
+            'max_missing': max_missing})
+
+    def test_index_not_built(self):
+        self.assertEqual(self.search(self.ingredients).status_code, 503)
+
+    def test_search_reads_change_log_without_writes(self):
+        build_pantry_index()
+        response = self.search(self.ingredients)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], self.recipes_count)
+        recipe = self.recipes[0]
+        RecipeIngredient.objects.filter(
+            recipe=recipe, ingredients=self.ingredients[0]).delete()
+        record_pantry_change(recipe.id)
+        with self.assertNumQueries(5) as queries:
+            response = self.search(self.ingredients[1:])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['id'] for item in response.data['results']],
+                         [recipe.id])
+        self.assertFalse([query['sql'] for query in queries.captured_queries
+                          if not query['sql'].startswith('SELECT')])
+
+
+@override_settings(REQUEST_METRICS=True)
+class RequestMetricsTest(RecipeAPITestCase):
+    """Фазы обработки запроса в заголовке Server-Timing."""
+
+    def get_timings(self, response):
+        return {
+            entry.split(';')[0]: float(entry.split('dur=')[1].split(';')[0])
+            for entry in response['Server-Timing'].split(', ')
+        }
+
+    def test_serialization_timed_separately(self):
+        response = self.client.get('/api/recipes/')
+        self.assertEqual(response.status_code, 200)
+        timings = self.get_timings(response)
+        self.assertEqual(
+            list(timings), ['db', 'app', 'serialize', 'render', 'total'])
+        self.assertGreater(timings['serialize'], 0)
+        self.assertLessEqual(timings['serialize'], timings['total'])
+
+    def test_serializers_not_patched(self):
+        response = self.client.get('/api/users/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('serialize;dur=', response['Server-Timing'])
+        self.assertIs(BaseSerializer.__dict__['data'], DRF_SERIALIZER_DATA)
+
+
+class ContentHashImageFieldTest(TestCase):
+    """Декодирование base64 и ограничения размера изображения."""
+
+    @staticmethod
+    def get_png(width, height):
+        buffer = BytesIO()
+        Image.new('RGB', (width, height), 'white').save(buffer, 'PNG')
+        return buffer.getvalue()
+
+    def decode(self, data):
+        upload = ContentHashImageField()._decode(data)
+        self.addCleanup(upload.close)
+        return upload
+
+    def assert_fails(self, data, code):
+        with self.assertRaises(ValidationError) as context:
+            ContentHashImageField()._decode(data)
+        self.assertEqual(context.exception.detail[0].code, code)
+
+    def test_line_breaks_in_base64(self):
+        content = os.urandom(DECODE_CHUNK_SIZE) + self.get_png(10, 10)
+        upload = self.decode(
+            'data:image/png;base64,' + encodebytes(content).decode())
+        self.assertEqual(upload.read(), content)
+        self.assertEqual(upload.size, len(content))
+
+    def test_data_after_padding(self):
+        self.assert_fails('data:image/png;base64,QQ==QQ==', 'invalid_base64')
+
+    @override_settings(IMAGE_UPLOAD_MAX_BYTES=1000)
+    def test_max_bytes(self):
+        content = os.urandom(1001)
+        self.assert_fails(
+            'data:image/png;base64,' + b64encode(content).decode(),
+            'max_bytes')
+        self.assert_fails(SimpleUploadedFile('image.png', content),
+                          'max_bytes')
+
+    @override_settings(IMAGE_UPLOAD_MAX_PIXELS=100)
+    def test_max_pixels(self):
+        content = self.get_png(20, 10)
+        self.assert_fails(
+            'data:image/png;base64,' + b64encode(content).decode(),
+            'max_pixels')
+        self.assert_fails(SimpleUploadedFile('image.png', content),
+                          'max_pixels')
+        self.assertEqual(
+            self.decode(SimpleUploadedFile(
+                'image.png', self.get_png(10, 10))).name, 'image.png')
+
+
+class FastJSONRendererTest(SimpleTestCase):
+    """FastJSONRenderer отвечает так же, как JSONRenderer."""
+
+    def render(self, renderer, data):
+        try:
+            return renderer.render(data)
+        except ValueError as error:
+            return str(error)
+
+    def assert_same(self, data, strict=True):
+        renderers = [JSONRenderer(), FastJSONRenderer()]
+        for renderer in renderers:
+            renderer.strict = strict
+        self.assertEqual(*(self.render(renderer, data)
+                           for renderer in renderers))
+
+    def test_non_finite_floats(self):
+        for value in (float('nan'), float('inf'), float('-inf')):
+            for strict in (True, False):
+                with self.subTest(value=value, strict=strict):
+                    self.assert_same(
+                        {'results': [{'amount': value}], 'next': None},
+                        strict)
+
+    def test_non_finite_decimal(self):
+        self.assert_same({'amount': Decimal('NaN'), 'next': None})
+
+    def test_null_and_floats(self):
+        self.assert_same({'results': [{'amount': 1.5, 'image': None}],
+                          'previous': None, 'ratio': 1e-05})
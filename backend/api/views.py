@@ -1,29 +1,78 @@
 import random
 import string
-from io import StringIO
+from hashlib import md5
 
 from django.conf import settings
-from django.db.models import Sum
-from django.http import HttpResponse
+from django.db import transaction
+from django.db.models import (BooleanField, F, Prefetch, Value,
+                              prefetch_related_objects)
+from django.http import Http404, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils.cache import (get_conditional_response, patch_vary_headers,
+                                quote_etag)
+from django.utils.http import http_date
 from rest_framework import mixins, status, viewsets
 from rest_framework.decorators import action
-from rest_framework.parsers import JSONParser
+from rest_framework.exceptions import APIException
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 
+from .caches import (get_cached_response, recipe_response_cache_key,
+                     set_cached_response)
 from .filters import FilterIngredient, FilterRecipe
-from .paginations import Pagination
+from .metrics import timed_serialization
+from .paginations import ApproximateCountPagination, PagePagination, Pagination
+from .parsers import LimitedJSONParser
 from .permissions import OnlyReadAuthorAdmin
+from .renderers import (ShoppingListCSVRenderer, ShoppingListJSONRenderer,
+                        ShoppingListPDFRenderer, ShoppingListTextRenderer)
 from .serializers import (AvatarSerializer, IngredientSerializer,
-                          PasswordSerializer, RecipeSerializer,
+                          PantryRecipeSerializer, PantrySerializer,
+                          PasswordSerializer, RecipeDocumentSerializer,
+                          RecipeSerializer, RecipesLimitSerializer,
                           RecipeWriteSerializer, SubscriptionsSerializer,
                           TagSerializer, UserSerializer)
-from recipes.models import Favourites, Ingredient, Recipe, ShoppingCart, Tag
+from recipes.catalog import get_catalog
+from recipes.counters import change_counter
+from recipes.documents import ensure_documents
+from recipes.models import (Favourites, Ingredient, Recipe, ShoppingCart,
+                            ShoppingListItem, Tag)
+from recipes.pantry import get_pantry_index, record_pantry_change
 from users.models import Subscriber, User
 
 
-class UserViewSet(viewsets.ModelViewSet):
+class PantryIndexUnavailable(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Индекс кладовой ещё не построен.'
+    default_code = 'pantry_index_unavailable'
+
+
+class SerializationTimingMixin:
+    """Сериализация ответов с замером для заголовка Server-Timing.
+
+    Действия list и retrieve повторяют ListModelMixin и
+    RetrieveModelMixin, но получают данные через serialize.
+    """
+
+    def serialize(self, serializer):
+        with timed_serialization(self.request):
+            return serializer.data
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(self.serialize(serializer))
+        serializer = self.get_serializer(queryset, many=True)
+        return Response(self.serialize(serializer))
+
+    def retrieve(self, request, *args, **kwargs):
+        return Response(self.serialize(self.get_serializer(
+            self.get_object())))
+
+
+class UserViewSet(SerializationTimingMixin, viewsets.ModelViewSet):
     """Управление пользователями"""
     queryset = User.objects.all()
     serializer_class = UserSerializer
@@ -35,22 +84,25 @@ class UserViewSet(viewsets.ModelViewSet):
     def me(self, request):
         """Возвращает текущего пользователя."""
         serializer = self.get_serializer(request.user)
-        return Response(serializer.data)
+        return Response(self.serialize(serializer))
 
     @action(detail=False, methods=['put', 'delete'], url_path='me/avatar',
-            permission_classes=[IsAuthenticated], parser_classes=[JSONParser])
+            permission_classes=[IsAuthenticated],
+            parser_classes=[LimitedJSONParser])
     def avatar(self, request):
         """Аватар пользователя."""
         user = request.user
         if request.method == 'DELETE':
-            user.avatar.delete()
+            if not User.objects.filter(avatar=user.avatar.name).exclude(
+                    pk=user.pk).exists():
+                user.avatar.delete(save=False)
             user.avatar = None
-            user.save()
+            user.save(update_fields=['avatar'])
             return Response(status=status.HTTP_204_NO_CONTENT)
         serializer = AvatarSerializer(user, data=request.data, partial=True)
         serializer.is_valid(raise_exception=True)
         serializer.save()
-        return Response(serializer.data)
+        return Response(self.serialize(serializer))
 
     @action(detail=False, methods=['post'],
             permission_classes=[IsAuthenticated])
@@ -60,7 +112,7 @@ class UserViewSet(viewsets.ModelViewSet):
                                         context={'request': request})
         serializer.is_valid(raise_exception=True)
         request.user.set_password(serializer.validated_data['new_password'])
-        request.user.save()
+        request.user.save(update_fields=['password'])
         return Response({'detail': 'Пароль успешно изменён.'},
                         status=status.HTTP_200_OK)
 
@@ -69,15 +121,22 @@ class UserViewSet(viewsets.ModelViewSet):
     def subscriptions(self, request):
         """Возвращает список подписан пользователя."""
         user = request.user
-        subscriptions = User.objects.filter(authors__user=user)
+        limit = self.get_recipes_limit(request)
+        subscriptions = User.objects.filter(authors__user=user).annotate(
+            is_subscribed=Value(True, output_field=BooleanField())
+        ).order_by('username')
         page = self.paginate_queryset(subscriptions)
-        if page is not None:
-            serializer = SubscriptionsSerializer(page, many=True,
-                                                 context={'request': request})
-            return self.get_paginated_response(serializer.data)
-        serializer = SubscriptionsSerializer(subscriptions, many=True,
+        authors = page if page is not None else list(subscriptions)
+        recipes = Recipe.objects.filter(author__in=authors)
+        if limit is not None:
+            recipes = recipes.limited_per_author(limit)
+        prefetch_related_objects(authors, Prefetch(
+            'recipes', queryset=recipes, to_attr='limited_recipes'))
+        serializer = SubscriptionsSerializer(authors, many=True,
                                              context={'request': request})
-        return Response(serializer.data)
+        if page is not None:
+            return self.get_paginated_response(self.serialize(serializer))
+        return Response(self.serialize(serializer))
 
     @action(detail=True, methods=['post', 'delete'],
             permission_classes=[IsAuthenticated])
@@ -85,58 +144,214 @@ class UserViewSet(viewsets.ModelViewSet):
         """Подписка и отписка от пользователя."""
         user = request.user
         author = get_object_or_404(User, id=pk)
+        limit = self.get_recipes_limit(request)
         subscription = self.get_subscription(user, author)
         if request.method == 'POST':
             if subscription:
                 return Response({'detail': 'Вы уже подписаны'},
                                 status=status.HTTP_400_BAD_REQUEST)
-            Subscriber.objects.create(user=user, author=author)
-            serializer = SubscriptionsSerializer(author,
-                                                 context={'request': request})
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
+            with transaction.atomic():
+                Subscriber.objects.create(user=user, author=author)
+                change_counter(User, author.id, 'subscribers_count', 1)
+            serializer = SubscriptionsSerializer(
+                author, context={'request': request, 'recipes_limit': limit})
+            return Response(self.serialize(serializer),
+                            status=status.HTTP_201_CREATED)
         if not subscription:
             return Response({'detail': 'Вы не подписаны'},
                             status=status.HTTP_400_BAD_REQUEST)
-        subscription.delete()
+        with transaction.atomic():
+            subscription.delete()
+            change_counter(User, author.id, 'subscribers_count', -1)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+    def get_recipes_limit(self, request):
+        """Проверенное значение параметра recipes_limit."""
+        serializer = RecipesLimitSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        return serializer.validated_data.get('recipes_limit')
+
     def get_subscription(self, user, author):
         """Получение подписки."""
         return Subscriber.objects.filter(user=user, author=author).first()
 
 
-class TagViewSet(mixins.ListModelMixin, mixins.RetrieveModelMixin,
-                 viewsets.GenericViewSet):
+class ConditionalMixin:
+    """Условные GET-запросы: 304 Not Modified по сильному ETag."""
+    etag = None
+    last_modified = None
+
+    def check_not_modified(self, request, *parts, last_modified=None):
+        """Запоминает валидаторы ответа и проверяет If-None-Match."""
+        self.etag = quote_etag(md5(repr(parts).encode()).hexdigest())
+        if last_modified is not None:
+            self.last_modified = int(last_modified.timestamp())
+        return get_conditional_response(request, etag=self.etag)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response,
+                                             *args, **kwargs)
+        if self.etag and response.status_code in (200, 304):
+            response['ETag'] = self.etag
+            if self.last_modified is not None:
+                response['Last-Modified'] = http_date(self.last_modified)
+            patch_vary_headers(response, ('Authorization',))
+        return response
+
+
+class CatalogMixin(ConditionalMixin, SerializationTimingMixin):
+    """Чтение справочника из снимка в памяти процесса."""
+    catalog_list = None
+    catalog_index = None
+
+    def list(self, request, *args, **kwargs):
+        catalog = get_catalog()
+        not_modified = self.check_not_modified(request, catalog.version,
+                                               self.catalog_list)
+        if not_modified is not None:
+            return not_modified
+        return self.list_catalog(request, catalog)
+
+    def list_catalog(self, request, catalog):
+        serializer = self.get_serializer(
+            getattr(catalog, self.catalog_list), many=True)
+        return Response(self.serialize(serializer))
+
+    def retrieve(self, request, *args, **kwargs):
+        catalog = get_catalog()
+        try:
+            pk = int(self.kwargs[self.lookup_field])
+        except ValueError:
+            raise Http404
+        obj = getattr(catalog, self.catalog_index).get(pk)
+        if obj is None:
+            raise Http404
+        not_modified = self.check_not_modified(request, catalog.version,
+                                               self.catalog_index, pk)
+        if not_modified is not None:
+            return not_modified
+        return Response(self.serialize(self.get_serializer(obj)))
+
+
+class TagViewSet(CatalogMixin, mixins.ListModelMixin,
+                 mixins.RetrieveModelMixin, viewsets.GenericViewSet):
     """Управление тегами"""
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     permission_classes = [AllowAny]
     pagination_class = None
+    catalog_list = 'tags'
+    catalog_index = 'tags_by_id'
 
 
-class IngredientViewSet(mixins.ListModelMixin, mixins.RetrieveModelMixin,
-                        viewsets.GenericViewSet):
+class IngredientViewSet(CatalogMixin, mixins.ListModelMixin,
+                        mixins.RetrieveModelMixin, viewsets.GenericViewSet):
     """Управление ингредиентами"""
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     filterset_class = FilterIngredient
     permission_classes = [AllowAny]
-    search_fields = ['name']
     pagination_class = None
+    catalog_list = 'ingredients'
+    catalog_index = 'ingredients_by_id'
+
+    def list_catalog(self, request, catalog):
+        if 'name' in request.query_params:
+            return SerializationTimingMixin.list(self, request)
+        return super().list_catalog(request, catalog)
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(ConditionalMixin, SerializationTimingMixin,
+                    viewsets.ModelViewSet):
     """Управление рецептами"""
     queryset = Recipe.objects.all()
-    pagination_class = Pagination
+    pagination_class = ApproximateCountPagination
     permission_classes = [OnlyReadAuthorAdmin]
     filterset_class = FilterRecipe
 
+    def get_queryset(self):
+        if self.action in ['list', 'retrieve']:
+            return Recipe.objects.for_documents(self.request.user)
+        # Фильтры is_favorited и is_in_shopping_cart работают и при
+        # изменении рецепта: get_object() тоже вызывает filter_queryset().
+        return Recipe.objects.with_user_flags(self.request.user)
+
     def get_serializer_class(self):
         if self.action in ['list', 'retrieve']:
-            return RecipeSerializer
+            return RecipeDocumentSerializer
         return RecipeWriteSerializer
 
+    def check_recipes_not_modified(self, request, recipes, *parts):
+        """ETag по версиям документов рецептов и признакам пользователя."""
+        return self.check_not_modified(
+            request, get_catalog().version, *parts, [
+                (recipe.id, recipe.updated_at.isoformat(),
+                 recipe.read_document_version, recipe.is_favorited,
+                 recipe.is_in_shopping_cart, recipe.is_author_subscribed)
+                for recipe in recipes
+            ],
+            last_modified=max(
+                (recipe.updated_at for recipe in recipes), default=None))
+
+    def cached_response(self, request, recipe_id, get_response):
+        """Ответ анонимному пользователю через кэш ответов."""
+        if not request.user.is_anonymous:
+            return get_response(request)
+        key = recipe_response_cache_key(request, recipe_id)
+        entry = get_cached_response(key)
+        if entry is None:
+            response = get_response(request)
+            if response.status_code == status.HTTP_200_OK:
+                set_cached_response(
+                    key, (response.data, self.etag, self.last_modified))
+            return response
+        data, self.etag, self.last_modified = entry
+        not_modified = get_conditional_response(request, etag=self.etag)
+        if not_modified is not None:
+            return not_modified
+        return Response(data)
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(request, None, self.list_recipes)
+
+    def list_recipes(self, request):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        if page is None:
+            recipes, meta = list(queryset), None
+        else:
+            recipes, meta = page, self.get_paginated_response([]).data
+        ensure_documents(recipes)
+        not_modified = self.check_recipes_not_modified(request, recipes,
+                                                       meta)
+        if not_modified is not None:
+            return not_modified
+        serializer = self.get_serializer(recipes, many=True)
+        if page is None:
+            return Response(self.serialize(serializer))
+        return self.get_paginated_response(self.serialize(serializer))
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(request, self.kwargs[self.lookup_field],
+                                    self.retrieve_recipe)
+
+    def retrieve_recipe(self, request):
+        recipe = self.get_object()
+        ensure_documents([recipe])
+        not_modified = self.check_recipes_not_modified(request, [recipe])
+        if not_modified is not None:
+            return not_modified
+        return Response(self.serialize(self.get_serializer(recipe)))
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            ShoppingListItem.objects.change_recipe(instance, dict(
+                instance.recipeingredients.values_list(
+                    'ingredients', 'amount')), {})
+            record_pantry_change(instance.id)
+            change_counter(User, instance.author_id, 'recipes_count', -1)
+            instance.delete()
+
     def toggle_recipe_status(self, request, model, pk=None):
         """Добавление или удаление рецепта в избранное или список покупок."""
         recipe = get_object_or_404(Recipe, id=pk)
@@ -146,17 +361,58 @@ class RecipeViewSet(viewsets.ModelViewSet):
             if exists:
                 return Response({'detail': 'Уже в списке'},
                                 status=status.HTTP_400_BAD_REQUEST)
-            model.objects.create(user=request.user, recipe=recipe)
+            with transaction.atomic():
+                model.objects.create(user=request.user, recipe=recipe)
+                if model is ShoppingCart:
+                    ShoppingListItem.objects.add_recipe(request.user, recipe)
+                else:
+                    change_counter(Recipe, recipe.id, 'favorites_count', 1)
+            recipe = Recipe.objects.for_read(request.user).get(id=recipe.id)
             serializer = RecipeSerializer(recipe, context={'request': request})
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
+            return Response(self.serialize(serializer),
+                            status=status.HTTP_201_CREATED)
 
         if request.method == 'DELETE':
             if not exists:
                 return Response({'detail': 'Не найдено'},
                                 status=status.HTTP_400_BAD_REQUEST)
-            obj.delete()
+            with transaction.atomic():
+                obj.delete()
+                if model is ShoppingCart:
+                    ShoppingListItem.objects.remove_recipe(request.user,
+                                                           recipe)
+                else:
+                    change_counter(Recipe, recipe.id, 'favorites_count', -1)
             return Response(status=status.HTTP_204_NO_CONTENT)
 
+    @action(detail=False, methods=['get'])
+    def pantry(self, request):
+        """Рецепты из имеющихся ингредиентов, лучшие совпадения первыми."""
+        params = PantrySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        index = get_pantry_index()
+        if index is None:
+            raise PantryIndexUnavailable
+        recipe_ids, missing = index.search(
+            params.validated_data['ingredients'],
+            params.validated_data['max_missing'])
+        paginator = PagePagination()
+        page = paginator.paginate_queryset(
+            range(len(recipe_ids)), request, view=self)
+        missing_counts = {int(recipe_ids[position]): int(missing[position])
+                          for position in page}
+        recipes = Recipe.objects.for_read(request.user).in_bulk(
+            missing_counts)
+        page = []
+        for recipe_id, missing_count in missing_counts.items():
+            recipe = recipes.get(recipe_id)
+            if recipe is not None:
+                recipe.missing_count = missing_count
+                page.append(recipe)
+        serializer = PantryRecipeSerializer(page, many=True,
+                                            context={'request': request})
+        return paginator.get_paginated_response(self.serialize(serializer))
+
     @action(detail=True, methods=['get'], url_path='get-link')
     def get_link(self, request, pk=None):
         recipe = get_object_or_404(Recipe, pk=pk)
@@ -181,29 +437,28 @@ class RecipeViewSet(viewsets.ModelViewSet):
         return self.toggle_recipe_status(request, ShoppingCart, pk)
 
     @action(detail=False, methods=['get'],
-            permission_classes=[IsAuthenticated])
+            permission_classes=[IsAuthenticated],
+            renderer_classes=[ShoppingListTextRenderer,
+                              ShoppingListCSVRenderer,
+                              ShoppingListJSONRenderer,
+                              ShoppingListPDFRenderer])
     def download_shopping_cart(self, request):
-        """Скачать список покупок в виде текстового файла."""
-        shopping_cart = ShoppingCart.objects.filter(
+        """Скачать список покупок в формате txt, csv, json или pdf."""
+        ingredients = ShoppingListItem.objects.filter(
             user=request.user
         ).values(
-            'recipe_id__ingredients__name',
-            'recipe_id__ingredients__measurement_unit'
-        ).annotate(
-            total_amount=Sum('recipe_id__recipeingredients__amount')
-        ).order_by('recipe_id__ingredients__name')
-
-        output = StringIO()
-        output.write('Ваш список покупок:\n')
-
-        for ingredient in shopping_cart:
-            name = ingredient['recipe_id__ingredients__name']
-            amount = ingredient['total_amount']
-            measurement_unit = ingredient[
-                'recipe_id__ingredients__measurement_unit']
-            output.write(f'{name} - {amount} ({measurement_unit}).\n')
-
-        response = HttpResponse(output.getvalue(), content_type='text/plain')
-        response['Content-Disposition'] = ('attachment; '
-                                           'filename="shopping_list.txt"')
+            'amount',
+            name=F('ingredient__name'),
+            measurement_unit=F('ingredient__measurement_unit')
+        ).order_by('name')
+
+        renderer = request.accepted_renderer
+        content_type = renderer.media_type
+        if renderer.charset:
+            content_type += f'; charset={renderer.charset}'
+        response = StreamingHttpResponse(
+            renderer.stream(ingredients.iterator()),
+            content_type=content_type)
+        response['Content-Disposition'] = (
+            f'attachment; filename="shopping_list.{renderer.format}"')
         return response
@@ -1,7 +1,11 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
+from django.db import transaction
+from django.db.models import Prefetch
 from import_export.admin import ImportExportActionModelAdmin
+from import_export.resources import ModelResource
 
+from .catalog import bump_catalog_version
 from .models import Ingredient, Recipe, RecipeIngredient, Tag
 from users.models import Subscriber, User
 
@@ -15,17 +19,11 @@ class AdminSubscribersInline(admin.TabularInline):
 class AdminUser(UserAdmin):
     """Админ модель для пользователей."""
     list_display = ('id', 'username', 'first_name', 'last_name',
-                    'email', 'get_subscribers',)
+                    'email', 'recipes_count', 'subscribers_count',)
     list_filter = ('username',)
     search_fields = ('username',)
     ordering = ('username',)
 
-    @admin.display(description='Подписчики')
-    def get_subscribers(self, obj):
-        subscribers = (Subscriber.objects.filter(author_id=obj.id)
-                       .values_list('user__username', flat=True))
-        return ', '.join(subscribers)
-
 
 class AdminRecipeIngredientInline(admin.TabularInline):
     """Модель для отображения ингредиентов рецепта в табличной форме."""
@@ -36,28 +34,50 @@ class AdminRecipeIngredientInline(admin.TabularInline):
 class AdminRecipe(admin.ModelAdmin):
     """Админ модель для рецептов."""
     inlines = (AdminRecipeIngredientInline,)
-    list_display = ('id', 'name', 'author',
+    list_display = ('id', 'name', 'author', 'favorites_count',
                     'get_tags', 'get_ingredients',)
     search_fields = ('name',)
     list_filter = ('name',)
     empty_value_display = 'Незадано'
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).defer(
+            'search_vector', 'read_document'
+        ).select_related(
+            'author'
+        ).prefetch_related(
+            'tags',
+            Prefetch('recipeingredients',
+                     queryset=RecipeIngredient.objects.select_related(
+                         'ingredients').order_by('id')),
+        )
+
     @admin.display(description='Теги')
     def get_tags(self, obj):
-        tags = obj.tags.values_list('name', flat=True)
-        return ', '.join(tags)
+        return ', '.join(tag.name for tag in obj.tags.all())
 
     @admin.display(description='Ингредиенты')
     def get_ingredients(self, obj):
-        ingredients = obj.recipeingredients.values_list(
-            'ingredients__name', 'amount', 'ingredients__measurement_unit')
         return ', '.join(
-            [f'{ingredient[0]} - {ingredient[1]} {ingredient[2]}'
-             for ingredient in ingredients])
+            f'{item.ingredients.name} - {item.amount} '
+            f'{item.ingredients.measurement_unit}'
+            for item in obj.recipeingredients.all())
+
+
+class IngredientResource(ModelResource):
+    """Ресурс импорта и экспорта ингредиентов."""
+
+    class Meta:
+        model = Ingredient
+
+    def after_import(self, dataset, result, **kwargs):
+        super().after_import(dataset, result, **kwargs)
+        transaction.on_commit(bump_catalog_version)
 
 
 class AdminIngredient(ImportExportActionModelAdmin, admin.ModelAdmin):
     """Админ модель для ингредиентов."""
+    resource_classes = (IngredientResource,)
     list_display = ('id', 'name', 'measurement_unit',)
     list_filter = ('name',)
     search_fields = ('name',)
@@ -0,0 +1,66 @@
+from .models import Ingredient, Tag
+from .versions import bump_version, get_version
+
+CATALOG_VERSION_KEY = 'recipes:catalog:version'
+
+_snapshot = None
+
+
+class TagRecord:
+    """Запись тега в снимке справочника."""
+    __slots__ = ('id', 'name', 'slug')
+
+    def __init__(self, id, name, slug):
+        self.id = id
+        self.name = name
+        self.slug = slug
+
+
+class IngredientRecord:
+    """Запись ингредиента в снимке справочника."""
+    __slots__ = ('id', 'name', 'measurement_unit')
+
+    def __init__(self, id, name, measurement_unit):
+        self.id = id
+        self.name = name
+        self.measurement_unit = measurement_unit
+
+
+class CatalogSnapshot:
+    """Снимок тегов и ингредиентов в памяти процесса."""
+    __slots__ = ('version', 'tags', 'tags_by_id', 'tags_by_slug',
+                 'ingredients', 'ingredients_by_id')
+
+    def __init__(self, version, tags, ingredients):
+        self.version = version
+        self.tags = tags
+        self.tags_by_id = {tag.id: tag for tag in tags}
+        self.tags_by_slug = {tag.slug: tag for tag in tags}
+        self.ingredients = ingredients
+        self.ingredients_by_id = {
+            ingredient.id: ingredient for ingredient in ingredients}
+
+    @classmethod
+    def load(cls, version):
+        return cls(
+            version,
+            [TagRecord(*row)
+             for row in Tag.objects.values_list('id', 'name', 'slug')],
+            [IngredientRecord(*row)
+             for row in Ingredient.objects.values_list(
+                 'id', 'name', 'measurement_unit')],
+        )
+
+
+def bump_catalog_version():
+    """Сбрасывает снимки справочника во всех процессах."""
+    bump_version(CATALOG_VERSION_KEY)
+
+
+def get_catalog():
+    """Возвращает актуальный снимок справочника."""
+    global _snapshot
+    version = get_version(CATALOG_VERSION_KEY)
+    if _snapshot is None or _snapshot.version != version:
+        _snapshot = CatalogSnapshot.load(version)
+    return _snapshot
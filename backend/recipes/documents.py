@@ -0,0 +1,63 @@
+from django.core.files.storage import default_storage
+
+from .models import Recipe
+
+
+def media_url(name):
+    return default_storage.url(name) if name else None
+
+
+def build_document(recipe):
+    """Документ рецепта без признаков конкретного пользователя.
+
+    Теги, ингредиенты и автор хранятся списками значений: jsonb не
+    сохраняет порядок ключей, а ответ должен совпадать с RecipeSerializer.
+    """
+    author = recipe.author
+    return {
+        'id': recipe.id,
+        'name': recipe.name,
+        'text': recipe.text,
+        'cooking_time': recipe.cooking_time,
+        'image': media_url(recipe.image.name),
+        'image_variants': {
+            file_format: {width: default_storage.url(name)
+                          for width, name in names.items()}
+            for file_format, names in recipe.image_variants.items()
+        },
+        'tags': [[tag.id, tag.name, tag.slug] for tag in recipe.tags.all()],
+        'ingredients': [
+            [item.ingredients.id, item.ingredients.name,
+             item.ingredients.measurement_unit, item.amount]
+            for item in recipe.recipeingredients.all()
+        ],
+        'author': [author.id, author.username, author.first_name,
+                   author.last_name, author.email,
+                   media_url(author.avatar.name)],
+    }
+
+
+def build_documents(recipe_ids):
+    """Собирает и сохраняет документы рецептов, возвращает их по id.
+
+    Документ сохраняется, только если его версия не изменилась с начала
+    сборки.
+    """
+    documents = {}
+    for recipe in Recipe.objects.with_relations().filter(pk__in=recipe_ids):
+        document = build_document(recipe)
+        Recipe.objects.filter(
+            pk=recipe.pk, read_document_version=recipe.read_document_version
+        ).update(read_document=document)
+        documents[recipe.pk] = document
+    return documents
+
+
+def ensure_documents(recipes):
+    """Достраивает документы рецептов, загруженных без них."""
+    missing = {recipe.pk: recipe for recipe in recipes
+               if recipe.read_document is None}
+    if not missing:
+        return
+    for recipe_id, document in build_documents(missing).items():
+        missing[recipe_id].read_document = document
@@ -0,0 +1,118 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from pathlib import PurePosixPath
+from threading import Lock
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connections, transaction
+from django.db.models import F
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from .models import Recipe
+from .versions import (RECIPE_RESPONSES_VERSION_KEY, bump_version,
+                       recipe_version_key)
+
+logger = logging.getLogger(__name__)
+
+VARIANT_FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+# В Pillow до 9.1 нет Image.Resampling.
+LANCZOS = getattr(Image, 'Resampling', Image).LANCZOS
+# Блокировки по хэшу имени: одно имя строится одним потоком, а число
+# блокировок не растёт вместе с числом изображений.
+LOCK_STRIPES = 64
+
+_executor = None
+_locks = tuple(Lock() for _ in range(LOCK_STRIPES))
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.IMAGE_WORKERS,
+            thread_name_prefix='image-variants')
+    return _executor
+
+
+def variant_name(name, width, file_format):
+    """Имя копии, одно и то же для одинаковых исходных файлов."""
+    return f'variants/{PurePosixPath(name).stem}/{width}.{file_format}'
+
+
+def prepare(image, file_format):
+    """Изображение в режиме, который поддерживает формат копии."""
+    has_alpha = 'A' in image.getbands() or 'transparency' in image.info
+    if file_format == 'webp' or not has_alpha:
+        return image.convert('RGBA' if has_alpha else 'RGB')
+    image = image.convert('RGBA')
+    background = Image.new('RGB', image.size, 'white')
+    background.paste(image, mask=image.getchannel('A'))
+    return background
+
+
+def build_variants(name):
+    """Создаёт копии изображения фиксированной ширины в WebP и JPEG.
+
+    Не увеличивает изображение и не пересоздаёт уже существующие копии.
+    Возвращает имена копий по формату и ширине.
+    """
+    with _locks[hash(name) % LOCK_STRIPES]:
+        return _build_variants(name)
+
+
+def _build_variants(name):
+    with default_storage.open(name) as file:
+        image = ImageOps.exif_transpose(Image.open(file))
+        image.load()
+    widths = [width for width in settings.IMAGE_VARIANT_WIDTHS
+              if width < image.width] or [image.width]
+    variants = {}
+    for file_format, (pil_format, options) in VARIANT_FORMATS.items():
+        source = prepare(image, file_format)
+        for width in widths:
+            target = variant_name(name, width, file_format)
+            if not default_storage.exists(target):
+                resized = source if width == image.width else source.resize(
+                    (width, max(round(image.height * width / image.width), 1)),
+                    LANCZOS)
+                buffer = BytesIO()
+                resized.save(buffer, pil_format, **options)
+                target = default_storage.save(
+                    target, ContentFile(buffer.getvalue()))
+            variants.setdefault(file_format, {})[str(width)] = target
+    return variants
+
+
+def update_recipe_variants(recipe_id):
+    """Строит копии изображения рецепта и сохраняет их имена."""
+    try:
+        name = Recipe.objects.filter(pk=recipe_id).values_list(
+            'image', flat=True).first()
+        if not name:
+            return
+        variants = build_variants(name)
+        if Recipe.objects.filter(pk=recipe_id, image=name).update(
+                image_variants=variants, updated_at=timezone.now(),
+                read_document=None,
+                read_document_version=F('read_document_version') + 1):
+            bump_version(RECIPE_RESPONSES_VERSION_KEY,
+                         recipe_version_key(recipe_id))
+    except Exception:
+        logger.exception('Не удалось построить копии изображения рецепта %s',
+                         recipe_id)
+    finally:
+        connections.close_all()
+
+
+def schedule_recipe_variants(recipe_id):
+    """Ставит построение копий в пул потоков после коммита транзакции."""
+    transaction.on_commit(
+        lambda: get_executor().submit(update_recipe_variants, recipe_id))
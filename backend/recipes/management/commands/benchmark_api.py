@@ -0,0 +1,275 @@
+import json
+import statistics
+import subprocess
+import time
+from math import ceil
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Exists, OuterRef
+from django.test import Client
+from django.test.utils import (CaptureQueriesContext, setup_test_environment,
+                               teardown_test_environment)
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from recipes.models import Favourites, Ingredient, Recipe, ShoppingCart, Tag
+from users.models import Subscriber, User
+
+IMAGE = ('data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJ'
+         'AAAADUlEQVR42mP8/5+hHgAHggJ/PchI7wAAAABJRU5ErkJggg==')
+
+
+def percentile(values, percent):
+    """Процентиль по методу ближайшего ранга."""
+    values = sorted(values)
+    return values[max(ceil(len(values) * percent / 100) - 1, 0)]
+
+
+class Route:
+    """Запрос к API, выполняемый в каждом проходе бенчмарка."""
+    __slots__ = ('method', 'path', 'auth', 'data', 'save_as')
+
+    def __init__(self, method, path, auth=True, data=None, save_as=None):
+        self.method = method
+        self.path = path
+        self.auth = auth
+        self.data = data
+        self.save_as = save_as
+
+    @property
+    def name(self):
+        name = f'{self.method.upper()} {self.path}'
+        return name if self.auth else f'{name} (anonymous)'
+
+
+class Command(BaseCommand):
+    """Замер задержек и числа SQL-запросов для маршрутов API."""
+    help = ('Прогоняет все маршруты API на текущей базе и сохраняет '
+            'p50/p95 задержки и число запросов в JSON.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--warmup', type=int, default=2)
+        parser.add_argument('--email', help='Пользователь для запросов с '
+                                            'авторизацией.')
+        parser.add_argument('--password', default='benchmark',
+                            help='Пароль пользователя для входа по токену.')
+        parser.add_argument('--output', help='Файл для результатов JSON.')
+        parser.add_argument('--compare', help='Предыдущие результаты JSON '
+                                              'для сравнения.')
+        parser.add_argument('--routes', help='Только маршруты, в названии '
+                                             'которых есть эта подстрока.')
+
+    def handle(self, *args, **options):
+        if options['iterations'] < 1:
+            raise CommandError('Нужна хотя бы одна итерация.')
+        user = self.get_user(options['email'])
+        state = self.get_state(user, options['password'])
+        routes = self.get_routes(state)
+        if options['routes']:
+            routes = [route for route in routes
+                      if options['routes'] in route.name]
+            if not routes:
+                raise CommandError('Нет маршрутов с такой подстрокой.')
+        samples = {route.name: ([], [], set()) for route in routes}
+        setup_test_environment()
+        try:
+            client = Client(raise_request_exception=False)
+            for iteration in range(options['warmup'] + options['iterations']):
+                for route in routes:
+                    elapsed, queries, status = self.run_route(
+                        client, route, state)
+                    if iteration >= options['warmup']:
+                        durations, counts, statuses = samples[route.name]
+                        durations.append(elapsed)
+                        counts.append(queries)
+                        statuses.add(status)
+        finally:
+            teardown_test_environment()
+        results = {
+            'meta': self.get_meta(options),
+            'routes': {
+                name: {
+                    'status': sorted(statuses),
+                    'p50_ms': round(percentile(durations, 50), 3),
+                    'p95_ms': round(percentile(durations, 95), 3),
+                    'mean_ms': round(statistics.mean(durations), 3),
+                    'queries': statistics.median_low(counts),
+                    'queries_max': max(counts),
+                }
+                for name, (durations, counts, statuses) in samples.items()
+            },
+        }
+        output = json.dumps(results, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                file.write(output)
+        else:
+            self.stdout.write(output)
+        if options['compare']:
+            self.compare(options['compare'], results)
+
+    def get_user(self, email):
+        if email:
+            user = User.objects.filter(email=email).first()
+        else:
+            user = User.objects.filter(
+                Exists(ShoppingCart.objects.filter(user=OuterRef('pk'))),
+                Exists(Subscriber.objects.filter(user=OuterRef('pk'))),
+            ).order_by('id').first()
+        if user is None:
+            raise CommandError('Нет подходящего пользователя, сначала '
+                               'выполните generate_data.')
+        return user
+
+    def get_state(self, user, password):
+        """Id объектов, на которых выполняются запросы."""
+        recipe = Recipe.objects.exclude(
+            favoriterecipes__user=user).exclude(
+            shoppingcarts__user=user).order_by('id').first()
+        author = User.objects.exclude(id=user.id).exclude(
+            authors__user=user).order_by('id').first()
+        tags = list(Tag.objects.order_by('id')[:3])
+        tag = tags[0] if tags else None
+        ingredients = list(Ingredient.objects.order_by('id')[:5])
+        if None in (recipe, author, tag) or not ingredients:
+            raise CommandError('Недостаточно данных, сначала выполните '
+                               'generate_data.')
+        return {
+            'user': user.id,
+            'email': user.email,
+            'password': password,
+            'token': Token.objects.get_or_create(user=user)[0].key,
+            'recipe': recipe.id,
+            'created': None,
+            'author': author.id,
+            'tag': tag.slug,
+            'tag_id': tag.id,
+            'tags': '&'.join(f'tags={tag.slug}' for tag in tags),
+            'ingredient': ingredients[0].id,
+            'autocomplete': self.get_autocomplete_queries(
+                ingredients[0].name),
+            'ingredients': '&'.join(
+                f'ingredients={ingredient.id}' for ingredient in ingredients),
+            'recipe_data': {
+                'name': 'Бенчмарк', 'text': 'Рецепт для бенчмарка',
+                'cooking_time': 10, 'image': IMAGE, 'tags': [tag.id],
+                'ingredients': [{'id': ingredient.id, 'amount': 10}
+                                for ingredient in ingredients],
+            },
+        }
+
+    @staticmethod
+    def get_autocomplete_queries(name):
+        """Запросы автодополнения: набор названия и часть слова."""
+        word = name.split()[-1]
+        return [*(name[:length] for length in range(1, min(len(name), 4) + 1)),
+                word[1:4] or name]
+
+    def get_routes(self, state):
+        recipe_data = state['recipe_data']
+        password = {'current_password': state['password'],
+                    'new_password': state['password']}
+        return [
+            Route('post', '/api/auth/token/login/', auth=False,
+                  data={'email': state['email'],
+                        'password': state['password']},
+                  save_as='token'),
+            Route('get', '/api/users/', auth=False),
+            Route('get', '/api/users/{user}/'),
+            Route('get', '/api/users/me/'),
+            Route('get', '/api/users/subscriptions/?recipes_limit=3'),
+            Route('post', '/api/users/{author}/subscribe/'),
+            Route('delete', '/api/users/{author}/subscribe/'),
+            Route('put', '/api/users/me/avatar/', data={'avatar': IMAGE}),
+            Route('delete', '/api/users/me/avatar/'),
+            Route('post', '/api/users/set_password/', data=password),
+            Route('get', '/api/tags/', auth=False),
+            Route('get', '/api/tags/{tag_id}/', auth=False),
+            Route('get', '/api/ingredients/', auth=False),
+            *(Route('get', f'/api/ingredients/?name={query}', auth=False)
+              for query in state['autocomplete']),
+            Route('get', '/api/ingredients/{ingredient}/', auth=False),
+            Route('get', '/api/recipes/', auth=False),
+            Route('get', '/api/recipes/'),
+            Route('get', '/api/recipes/?tags={tag}&limit=12'),
+            Route('get', '/api/recipes/?{tags}&limit=12'),
+            Route('get', '/api/recipes/?{tags}&author={author}'),
+            Route('get', '/api/recipes/?is_favorited=1'),
+            Route('get', '/api/recipes/?is_in_shopping_cart=1'),
+            Route('get', '/api/recipes/?author={author}', auth=False),
+            Route('get', '/api/recipes/?search=суп', auth=False),
+            Route('get', '/api/recipes/?search=суп'),
+            Route('get', '/api/recipes/?search=острый+пирог'),
+            Route('get', '/api/recipes/?search=пирог&{tags}'),
+            Route('get', '/api/recipes/?search=пирог&author={author}'),
+            Route('get', '/api/recipes/?search=несуществующее'),
+            Route('get', '/api/recipes/?cursor=', auth=False),
+            Route('get', '/api/recipes/pantry/?{ingredients}'),
+            Route('get', '/api/recipes/{recipe}/', auth=False),
+            Route('get', '/api/recipes/{recipe}/'),
+            Route('get', '/api/recipes/{recipe}/get-link/', auth=False),
+            Route('post', '/api/recipes/{recipe}/favorite/'),
+            Route('delete', '/api/recipes/{recipe}/favorite/'),
+            Route('post', '/api/recipes/{recipe}/shopping_cart/'),
+            Route('get', '/api/recipes/download_shopping_cart/'),
+            Route('get', '/api/recipes/download_shopping_cart/?format=pdf'),
+            Route('delete', '/api/recipes/{recipe}/shopping_cart/'),
+            Route('post', '/api/recipes/', data=recipe_data,
+                  save_as='created'),
+            Route('patch', '/api/recipes/{created}/', data=recipe_data),
+            Route('delete', '/api/recipes/{created}/'),
+            Route('post', '/api/auth/token/logout/'),
+        ]
+
+    def run_route(self, client, route, state):
+        headers = {}
+        if route.auth:
+            headers['HTTP_AUTHORIZATION'] = f'Token {state["token"]}'
+        data = json.dumps(route.data) if route.data is not None else ''
+        path = route.path.format(**state)
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            response = client.generic(
+                route.method.upper(), path, data,
+                content_type='application/json', **headers)
+            if response.streaming:
+                b''.join(response.streaming_content)
+            elapsed = (time.perf_counter() - started) * 1000
+        if route.save_as and response.status_code < 400:
+            body = response.json()
+            state[route.save_as] = body.get('id', body.get('auth_token'))
+        return elapsed, len(queries), response.status_code
+
+    def get_meta(self, options):
+        try:
+            commit = subprocess.run(
+                ('git', 'rev-parse', 'HEAD'), capture_output=True,
+                text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            commit = None
+        return {
+            'commit': commit,
+            'timestamp': timezone.now().isoformat(),
+            'database': connection.vendor,
+            'iterations': options['iterations'],
+            'users': User.objects.count(),
+            'recipes': Recipe.objects.count(),
+            'favorites': Favourites.objects.count(),
+        }
+
+    def compare(self, path, results):
+        """Вывод изменений p95 и числа запросов относительно прошлого."""
+        with open(path, encoding='utf-8') as file:
+            previous = json.load(file)['routes']
+        for name, current in results['routes'].items():
+            before = previous.get(name)
+            if before is None:
+                continue
+            change = ((current['p95_ms'] - before['p95_ms'])
+                      / max(before['p95_ms'], 1e-6) * 100)
+            self.stderr.write(
+                f'{name}: p95 {before["p95_ms"]} -> {current["p95_ms"]} мс '
+                f'({change:+.0f}%), запросов {before["queries"]} -> '
+                f'{current["queries"]}')
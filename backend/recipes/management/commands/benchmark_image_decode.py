@@ -0,0 +1,75 @@
+import base64
+import gc
+import os
+import time
+import tracemalloc
+from io import BytesIO
+
+from django.core.management.base import BaseCommand, CommandError
+from drf_base64.fields import Base64ImageField
+from PIL import Image
+from rest_framework import serializers
+
+from api.serializers import AvatarSerializer
+from users.models import User
+
+
+class LegacyAvatarSerializer(serializers.ModelSerializer):
+    """Аватар с декодированием base64 целиком в памяти"""
+    avatar = Base64ImageField()
+
+    class Meta:
+        model = User
+        fields = ('avatar',)
+
+
+class Command(BaseCommand):
+    """Сравнение пиковой памяти при разборе изображения в base64."""
+    help = ('Проверяет одно и то же изображение в base64 прежним и '
+            'потоковым полем и выводит пиковую память и время.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=1200,
+                            help='Сторона квадратного PNG из шума.')
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, **options):
+        if options['size'] < 1 or options['repeat'] < 1:
+            raise CommandError('Размер и число повторов должны быть больше 0.')
+        payload = self.make_payload(options['size'])
+        self.stdout.write(f'Данные base64: {len(payload) / 2 ** 20:.1f} МиБ')
+        for name, serializer_class in (('base64', LegacyAvatarSerializer),
+                                       ('streaming', AvatarSerializer)):
+            peaks, durations = [], []
+            for _ in range(options['repeat']):
+                peak, duration = self.measure(serializer_class, payload)
+                peaks.append(peak)
+                durations.append(duration)
+            self.stdout.write(
+                f'{name}: пик {min(peaks) / 2 ** 20:.1f} МиБ, '
+                f'{min(durations) * 1000:.0f} мс')
+
+    @staticmethod
+    def make_payload(size):
+        image = Image.frombytes(
+            'RGB', (size, size), os.urandom(size * size * 3))
+        buffer = BytesIO()
+        image.save(buffer, 'PNG', compress_level=1)
+        encoded = base64.b64encode(buffer.getvalue()).decode()
+        return f'data:image/png;base64,{encoded}'
+
+    def measure(self, serializer_class, payload):
+        """Пиковая память Python сверх уже загруженного запроса."""
+        gc.collect()
+        tracemalloc.start()
+        started = time.perf_counter()
+        serializer = serializer_class(data={'avatar': payload})
+        valid = serializer.is_valid()
+        duration = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        if not valid:
+            raise CommandError(f'{serializer_class.__name__}: '
+                               f'{serializer.errors}')
+        del serializer
+        return peak, duration
@@ -0,0 +1,66 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory
+
+from api.renderers import FastJSONRenderer, orjson
+from api.views import RecipeViewSet, UserViewSet
+
+
+class Command(BaseCommand):
+    """Сравнение JSONRenderer и FastJSONRenderer на страницах API."""
+    help = ('Отрисовывает настоящие страницы списков рецептов и '
+            'пользователей обоими рендерерами и выводит время на страницу.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=50,
+                            help='Объектов на странице.')
+        parser.add_argument('--pages', type=int, default=5)
+        parser.add_argument('--iterations', type=int, default=200)
+
+    def handle(self, *args, **options):
+        if min(options['limit'], options['pages'],
+               options['iterations']) < 1:
+            raise CommandError('Параметры должны быть больше 0.')
+        if orjson is None:
+            self.stderr.write('orjson не установлен, FastJSONRenderer '
+                              'работает как JSONRenderer.')
+        payloads = self.get_payloads(options['limit'], options['pages'])
+        results = {}
+        for renderer in (JSONRenderer(), FastJSONRenderer()):
+            started = time.perf_counter()
+            for _ in range(options['iterations']):
+                for _, data in payloads:
+                    renderer.render(data)
+            elapsed = time.perf_counter() - started
+            results[type(renderer).__name__] = (
+                elapsed / options['iterations'] / len(payloads))
+        for name, data in payloads:
+            if JSONRenderer().render(data) != FastJSONRenderer().render(data):
+                raise CommandError(f'{name}: ответы рендереров различаются.')
+        size = sum(len(JSONRenderer().render(data)) for _, data in payloads)
+        self.stdout.write(f'Страниц: {len(payloads)}, в среднем '
+                          f'{size / len(payloads) / 1024:.1f} КиБ.')
+        for name, duration in results.items():
+            self.stdout.write(f'{name}: {duration * 1e6:.0f} мкс на страницу')
+        speedup = results['JSONRenderer'] / results['FastJSONRenderer']
+        self.stdout.write(self.style.SUCCESS(
+            f'Ускорение: {speedup:.1f}x, ответы совпадают.'))
+
+    def get_payloads(self, limit, pages):
+        """Данные страниц списков, как их возвращают представления."""
+        factory = APIRequestFactory()
+        views = (('/api/recipes/', RecipeViewSet.as_view({'get': 'list'})),
+                 ('/api/users/', UserViewSet.as_view({'get': 'list'})))
+        payloads = []
+        for path, view in views:
+            for page in range(1, pages + 1):
+                response = view(factory.get(
+                    path, {'limit': limit, 'page': page}))
+                if response.status_code == 200:
+                    payloads.append((f'{path}?page={page}', response.data))
+        if not payloads:
+            raise CommandError('Нет данных, сначала выполните '
+                               'generate_data.')
+        return payloads
@@ -0,0 +1,153 @@
+import csv
+import gc
+import json
+import re
+import time
+import tracemalloc
+from io import StringIO
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count
+from rest_framework.test import APIClient
+
+from recipes.models import Recipe, ShoppingCart, ShoppingListItem
+from users.models import User
+
+FORMATS = ('txt', 'csv', 'json', 'pdf')
+TEXT_LINE = re.compile(r'^(.*) - (\d+) \((.*)\)\.$')
+
+
+class Rollback(Exception):
+    """Откат корзины, собранной для замера."""
+
+
+class Command(BaseCommand):
+    """Проверка и замер выгрузки большого списка покупок."""
+    help = ('Собирает корзину из многих рецептов, сверяет выгрузку во всех '
+            'форматах с суммами по ингредиентам рецептов и выводит пиковую '
+            'память и время. Изменения в базе откатываются.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipes', type=int, default=500,
+                            help='Рецептов в корзине.')
+        parser.add_argument('--email', help='Пользователь, иначе тот, у '
+                                            'кого больше всего в корзине.')
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, **options):
+        if options['recipes'] < 1 or options['repeat'] < 1:
+            raise CommandError('Параметры должны быть больше 0.')
+        user = self.get_user(options['email'])
+        try:
+            with transaction.atomic():
+                self.fill_cart(user, options['recipes'])
+                self.run(user, options['repeat'])
+                raise Rollback
+        except Rollback:
+            pass
+
+    def get_user(self, email):
+        users = User.objects.all()
+        if email:
+            users = users.filter(email=email)
+        user = users.annotate(
+            cart_size=Count('shoppingcarts')
+        ).order_by('-cart_size', 'id').first()
+        if user is None:
+            raise CommandError('Нет пользователя, сначала выполните '
+                               'generate_data.')
+        return user
+
+    def fill_cart(self, user, count):
+        """Добавляет рецепты в корзину так же, как это делает API."""
+        missing = count - ShoppingCart.objects.filter(user=user).count()
+        recipes = Recipe.objects.exclude(shoppingcarts__user=user).order_by(
+            'id')[:max(missing, 0)]
+        for recipe in recipes:
+            ShoppingCart.objects.create(user=user, recipe=recipe)
+            ShoppingListItem.objects.add_recipe(user, recipe)
+        size = ShoppingCart.objects.filter(user=user).count()
+        if size < count:
+            raise CommandError(f'В базе только {size} рецептов для корзины.')
+
+    def run(self, user, repeat):
+        expected = self.get_expected(user)
+        self.stdout.write(
+            f'{user.email}: рецептов в корзине '
+            f'{ShoppingCart.objects.filter(user=user).count()}, '
+            f'ингредиентов {len(expected)}.')
+        for file_format in FORMATS:
+            content = b''.join(self.get_chunks(user, file_format))
+            self.check_content(file_format, content, expected)
+            peaks, durations = [], []
+            for _ in range(repeat):
+                peak, duration = self.measure(user, file_format)
+                peaks.append(peak)
+                durations.append(duration)
+            self.stdout.write(
+                f'{file_format}: {len(content) / 1024:.1f} КиБ, пик '
+                f'{min(peaks) / 1024:.1f} КиБ, '
+                f'{min(durations) * 1000:.0f} мс')
+        self.stdout.write(self.style.SUCCESS('Выгрузки совпадают с '
+                                             'суммами по рецептам.'))
+
+    def get_expected(self, user):
+        """Суммы по ингредиентам рецептов корзины, посчитанные заново."""
+        materialized = dict(ShoppingListItem.objects.filter(
+            user=user).values_list('ingredient', 'amount'))
+        calculated = ShoppingListItem.objects.calculate(user)
+        if materialized != calculated:
+            raise CommandError('Сохранённый список покупок расходится с '
+                               'корзиной.')
+        return {
+            (item.ingredient.name, item.ingredient.measurement_unit):
+                item.amount
+            for item in ShoppingListItem.objects.filter(
+                user=user).select_related('ingredient')
+        }
+
+    def get_chunks(self, user, file_format):
+        client = APIClient()
+        client.force_authenticate(user)
+        response = client.get('/api/recipes/download_shopping_cart/',
+                              {'format': file_format})
+        if response.status_code != 200:
+            raise CommandError(f'{file_format}: ответ '
+                               f'{response.status_code}.')
+        return response.streaming_content
+
+    def measure(self, user, file_format):
+        """Пиковая память Python при отдаче выгрузки клиенту.
+
+        Части ответа не копятся, как при отправке по сети, поэтому пик
+        показывает, сколько выгрузка держит в памяти сама.
+        """
+        gc.collect()
+        tracemalloc.start()
+        started = time.perf_counter()
+        for _ in self.get_chunks(user, file_format):
+            pass
+        duration = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return peak, duration
+
+    def check_content(self, file_format, content, expected):
+        if file_format == 'pdf':
+            if not content.startswith(b'%PDF'):
+                raise CommandError('pdf: ответ не является PDF.')
+            return
+        text = content.decode()
+        if file_format == 'txt':
+            rows = [TEXT_LINE.match(line).groups()
+                    for line in text.splitlines()[1:]]
+        elif file_format == 'csv':
+            rows = list(csv.reader(StringIO(text)))[1:]
+        else:
+            rows = [(item['name'], item['amount'], item['measurement_unit'])
+                    for item in json.loads(text)]
+        actual = {(name, unit): int(amount) for name, amount, unit in rows}
+        if actual != expected:
+            raise CommandError(f'{file_format}: выгрузка не совпадает с '
+                               f'суммами по рецептам.')
@@ -0,0 +1,33 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from recipes.images import update_recipe_variants
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    """Построение копий изображений для уже загруженных рецептов."""
+    help = 'Создаёт WebP и JPEG копии изображений рецептов без копий.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force', action='store_true',
+            help='Перестроить копии для всех рецептов.')
+        parser.add_argument(
+            '--workers', type=int, default=settings.IMAGE_WORKERS,
+            help='Количество потоков обработки.')
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.exclude(image='')
+        if not options['force']:
+            recipes = recipes.filter(image_variants={})
+        recipe_ids = list(recipes.values_list('id', flat=True))
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            for _ in executor.map(update_recipe_variants, recipe_ids):
+                pass
+        built = Recipe.objects.filter(id__in=recipe_ids).exclude(
+            image_variants={}).count()
+        self.stdout.write(self.style.SUCCESS(
+            f'Обработано рецептов: {built} из {len(recipe_ids)}.'))
@@ -0,0 +1,23 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from recipes.pantry import build_pantry_index
+
+
+class Command(BaseCommand):
+    """Построение индекса подбора рецептов по кладовой."""
+    help = ('Строит индекс кладовой по всем рецептам в файл '
+            'PANTRY_INDEX_PATH. Запускается по расписанию, например раз в '
+            'час: процессы API подхватывают новый файл и догоняют его по '
+            'журналу изменений.')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        index = build_pantry_index()
+        self.stdout.write(self.style.SUCCESS(
+            f'Индекс кладовой: ингредиентов {len(index.postings)}, '
+            f'рецептов {int((index.totals > 0).sum())} за '
+            f'{time.monotonic() - started:.1f} с, '
+            f'{settings.PANTRY_INDEX_PATH}.'))
@@ -0,0 +1,183 @@
+import csv
+import random
+import time
+from io import StringIO
+from itertools import islice
+
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max
+
+from recipes.catalog import bump_catalog_version
+from recipes.models import (Favourites, Ingredient, Recipe, RecipeIngredient,
+                            ShoppingCart, Tag)
+from recipes.versions import (RECIPE_LIST_VERSION_KEY,
+                              RECIPE_RESPONSES_VERSION_KEY, bump_version)
+from users.models import Subscriber, User
+
+BATCH_SIZE = 5000
+TAGS = (('Завтрак', 'breakfast'), ('Обед', 'lunch'), ('Ужин', 'dinner'),
+        ('Десерт', 'dessert'), ('Выпечка', 'bakery'), ('Суп', 'soup'))
+WORDS = ('быстрый', 'домашний', 'пряный', 'нежный', 'летний', 'сытный',
+         'острый', 'лёгкий', 'салат', 'суп', 'пирог', 'омлет', 'рагу',
+         'паста', 'каша', 'запеканка', 'с', 'и', 'из', 'по-деревенски')
+IMAGE = 'recipes_images/generated.png'
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+class Command(BaseCommand):
+    """Генерация синтетических данных для нагрузочного тестирования."""
+    help = ('Создаёт пользователей, рецепты, избранное, корзины и подписки '
+            'с воспроизводимым случайным распределением.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--recipes', type=int, default=10000)
+        parser.add_argument('--tags', type=int, default=len(TAGS),
+                            help='Сколько тегов должно быть, сверх '
+                                 'основных добавляются нумерованные.')
+        parser.add_argument('--ingredients', type=int, default=2000,
+                            help='Сколько ингредиентов создать, если '
+                                 'справочник пуст.')
+        parser.add_argument('--ingredients-file',
+                            help='CSV с ингредиентами вместо случайных '
+                                 'названий, например data/ingredients.csv.')
+        parser.add_argument('--ingredients-scale', type=int, default=1,
+                            help='Сколько копий файла ингредиентов создать.')
+        parser.add_argument('--min-ingredients', type=int, default=3)
+        parser.add_argument('--max-ingredients', type=int, default=12)
+        parser.add_argument('--favorites', type=int, default=20,
+                            help='Избранных рецептов на пользователя.')
+        parser.add_argument('--cart', type=int, default=5,
+                            help='Рецептов в корзине пользователя.')
+        parser.add_argument('--subscriptions', type=int, default=10,
+                            help='Подписок на пользователя.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        parser.add_argument('--password', default='benchmark')
+
+    def handle(self, *args, **options):
+        if options['users'] < 2 or options['recipes'] < 1:
+            raise CommandError('Нужно хотя бы два пользователя и рецепт.')
+        if options['ingredients_scale'] < 1:
+            raise CommandError('Число копий ингредиентов должно быть '
+                               'больше 0.')
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.verbosity = options['verbosity']
+        started = time.monotonic()
+        tag_ids = self.create_tags(options['tags'])
+        ingredient_ids = self.create_ingredients(
+            options['ingredients'], options['ingredients_file'],
+            options['ingredients_scale'])
+        user_ids = self.create_users(options['users'], options['password'])
+        recipe_ids = self.create_recipes(options['recipes'], user_ids)
+        self.bulk_insert(RecipeIngredient, (
+            RecipeIngredient(recipe_id=recipe_id, ingredients_id=ingredient_id,
+                             amount=self.rng.randint(1, 500))
+            for recipe_id in recipe_ids
+            for ingredient_id in self.rng.sample(ingredient_ids, min(
+                len(ingredient_ids), self.rng.randint(
+                    options['min_ingredients'], options['max_ingredients'])))
+        ))
+        self.bulk_insert(Recipe.tags.through, (
+            Recipe.tags.through(recipe_id=recipe_id, tag_id=tag_id)
+            for recipe_id in recipe_ids
+            for tag_id in self.rng.sample(tag_ids, self.rng.randint(1, 3))
+        ))
+        for model, per_user in ((Favourites, options['favorites']),
+                                (ShoppingCart, options['cart'])):
+            self.bulk_insert(model, (
+                model(user_id=user_id, recipe_id=recipe_id)
+                for user_id in user_ids
+                for recipe_id in self.sample(recipe_ids, per_user)
+            ))
+        self.bulk_insert(Subscriber, (
+            Subscriber(user_id=user_id, author_id=author_id)
+            for user_id in user_ids
+            for author_id in self.sample(user_ids, options['subscriptions'])
+            if author_id != user_id
+        ))
+        call_command('reconcile_counters', stdout=StringIO())
+        call_command('rebuild_shopping_lists', stdout=StringIO())
+        call_command('rebuild_recipe_documents', stdout=StringIO())
+        call_command('build_pantry_index', stdout=StringIO())
+        bump_catalog_version()
+        bump_version(RECIPE_LIST_VERSION_KEY, RECIPE_RESPONSES_VERSION_KEY)
+        self.stdout.write(self.style.SUCCESS(
+            f'Создано пользователей: {len(user_ids)}, рецептов: '
+            f'{len(recipe_ids)} за {time.monotonic() - started:.1f} с.'))
+
+    def sample(self, population, count):
+        return self.rng.sample(population, min(count, len(population)))
+
+    def bulk_insert(self, model, objects):
+        count = 0
+        for batch in batched(objects, self.batch_size):
+            model.objects.bulk_create(batch, ignore_conflicts=True)
+            count += len(batch)
+        if self.verbosity > 1:
+            self.stdout.write(f'{model._meta.verbose_name}: {count}')
+
+    def created_ids(self, model, last_id):
+        """Id созданных строк, bulk_create не везде их возвращает."""
+        return list(model.objects.filter(id__gt=last_id or 0).order_by(
+            'id').values_list('id', flat=True))
+
+    def create_tags(self, count):
+        tags = [*TAGS, *((f'Тег {number}', f'tag-{number}')
+                         for number in range(len(TAGS) + 1, count + 1))]
+        for name, slug in tags[:max(count, 1)]:
+            Tag.objects.get_or_create(slug=slug, defaults={'name': name})
+        return list(Tag.objects.values_list('id', flat=True))
+
+    def create_ingredients(self, count, path, scale):
+        if not Ingredient.objects.exists() and path:
+            self.bulk_insert(Ingredient, self.read_ingredients(path, scale))
+        elif not Ingredient.objects.exists():
+            self.bulk_insert(Ingredient, (
+                Ingredient(name=f'ингредиент {number}',
+                           measurement_unit=self.rng.choice(('г', 'мл', 'шт')))
+                for number in range(count)
+            ))
+        return list(Ingredient.objects.values_list('id', flat=True))
+
+    def read_ingredients(self, path, scale):
+        """Ингредиенты из CSV, копии отличаются номером в названии."""
+        with open(path, encoding='utf-8', newline='') as file:
+            rows = [row for row in csv.reader(file) if row]
+        for copy in range(scale):
+            for name, measurement_unit in rows:
+                yield Ingredient(
+                    name=name if copy == 0 else f'{name} {copy}',
+                    measurement_unit=measurement_unit)
+
+    def create_users(self, count, password):
+        last_id = User.objects.aggregate(last_id=Max('id'))['last_id']
+        prefix = f'bench{last_id or 0}'
+        password = make_password(password)
+        self.bulk_insert(User, (
+            User(username=f'{prefix}_{number}',
+                 email=f'{prefix}_{number}@example.com',
+                 first_name=f'Имя{number}', last_name=f'Фамилия{number}',
+                 password=password)
+            for number in range(count)
+        ))
+        return self.created_ids(User, last_id)
+
+    def create_recipes(self, count, user_ids):
+        last_id = Recipe.objects.aggregate(last_id=Max('id'))['last_id']
+        self.bulk_insert(Recipe, (
+            Recipe(author_id=self.rng.choice(user_ids), image=IMAGE,
+                   name=' '.join(self.rng.choices(WORDS, k=3)).capitalize(),
+                   text=' '.join(self.rng.choices(WORDS, k=40)),
+                   cooking_time=self.rng.randint(1, 240))
+            for _ in range(count)
+        ))
+        return self.created_ids(Recipe, last_id)
@@ -0,0 +1,184 @@
+import csv
+import json
+import time
+from io import StringIO
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from recipes.catalog import bump_catalog_version
+from recipes.models import Ingredient, Recipe
+
+BATCH_SIZE = 5000
+READ_SIZE = 64 * 1024
+MAX_ITEM_SIZE = 1024 * 1024
+UPDATE_BATCH_SIZE = 500
+STAGING_TABLE = 'recipes_ingredient_import'
+
+
+def read_csv(file):
+    """Строки CSV вида "название,единица измерения"."""
+    for row in csv.reader(file):
+        if row:
+            yield row
+
+
+def read_json(file):
+    """Объекты JSON-массива, прочитанные из файла по частям."""
+    decoder = json.JSONDecoder()
+    buffer, position, eof = '', 0, False
+    expected = '['
+    while True:
+        while position < len(buffer) and buffer[position].isspace():
+            position += 1
+        if position == len(buffer):
+            if eof:
+                raise ValueError('Неожиданный конец файла.')
+            buffer, position = file.read(READ_SIZE), 0
+            eof = not buffer
+            continue
+        char = buffer[position]
+        if expected in '[,' and char == expected:
+            position += 1
+            expected = 'value'
+            continue
+        if expected in '[,' or char == ']':
+            if char == ']' and expected != '[':
+                return
+            raise ValueError(f'Ожидался символ {expected!r}.')
+        try:
+            item, position = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            chunk = file.read(READ_SIZE)
+            if not chunk or len(buffer) - position > MAX_ITEM_SIZE:
+                raise
+            buffer, position = buffer[position:] + chunk, 0
+            continue
+        yield item
+        expected = ','
+
+
+def upsert_postgresql(ingredients):
+    """Загрузка пачки через COPY во временную таблицу и INSERT ON CONFLICT.
+
+    Возвращает id добавленных и изменённых ингредиентов.
+    """
+    table = Ingredient._meta.db_table
+    buffer = StringIO()
+    csv.writer(buffer).writerows(ingredients.items())
+    buffer.seek(0)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'CREATE TEMPORARY TABLE IF NOT EXISTS {STAGING_TABLE} '
+            f'(name varchar(200), measurement_unit varchar(200)) '
+            f'ON COMMIT DELETE ROWS')
+        cursor.copy_expert(
+            f'COPY {STAGING_TABLE} (name, measurement_unit) '
+            f'FROM STDIN WITH (FORMAT csv)', buffer)
+        cursor.execute(
+            f'INSERT INTO {table} (name, measurement_unit) '
+            f'SELECT name, measurement_unit FROM {STAGING_TABLE} '
+            f'ON CONFLICT (name) DO UPDATE '
+            f'SET measurement_unit = EXCLUDED.measurement_unit '
+            f'WHERE {table}.measurement_unit '
+            f'IS DISTINCT FROM EXCLUDED.measurement_unit '
+            f'RETURNING {table}.id')
+        return [row[0] for row in cursor.fetchall()]
+
+
+def upsert_generic(ingredients):
+    """Загрузка пачки через bulk_update и bulk_create.
+
+    Возвращает id изменённых ингредиентов.
+    """
+    existing = Ingredient.objects.in_bulk(list(ingredients),
+                                          field_name='name')
+    changed = []
+    for name, ingredient in existing.items():
+        if ingredient.measurement_unit != ingredients[name]:
+            ingredient.measurement_unit = ingredients[name]
+            changed.append(ingredient)
+    Ingredient.objects.bulk_update(changed, ['measurement_unit'],
+                                   batch_size=UPDATE_BATCH_SIZE)
+    Ingredient.objects.bulk_create([
+        Ingredient(name=name, measurement_unit=measurement_unit)
+        for name, measurement_unit in ingredients.items()
+        if name not in existing
+    ], ignore_conflicts=True)
+    return [ingredient.id for ingredient in changed]
+
+
+class Command(BaseCommand):
+    """Потоковая загрузка ингредиентов из CSV или JSON."""
+    help = ('Загружает ингредиенты из CSV или JSON пачками, обновляя '
+            'единицы измерения уже существующих.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Путь к файлу с ингредиентами.')
+        parser.add_argument(
+            '--format', choices=('csv', 'json'),
+            help='Формат файла, по умолчанию по расширению.')
+        parser.add_argument(
+            '--batch-size', type=int, default=BATCH_SIZE,
+            help='Количество строк в одной пачке.')
+
+    def handle(self, *args, **options):
+        path = Path(options['path'])
+        file_format = options['format'] or path.suffix.lstrip('.').lower()
+        if file_format not in ('csv', 'json'):
+            raise CommandError('Укажите формат файла: csv или json.')
+        self.verbosity = options['verbosity']
+        upsert = (upsert_postgresql if connection.vendor == 'postgresql'
+                  else upsert_generic)
+        started = time.monotonic()
+        count = 0
+        try:
+            with path.open(encoding='utf-8', newline='') as file:
+                rows = read_csv(file) if file_format == 'csv' else (
+                    self.json_row(item) for item in read_json(file))
+                batch = {}
+                for count, row in enumerate(rows, 1):
+                    name, measurement_unit = self.clean_row(row, count)
+                    batch[name] = measurement_unit
+                    if len(batch) >= options['batch_size']:
+                        self.save_batch(upsert, batch, count, started)
+                        batch = {}
+                if batch:
+                    self.save_batch(upsert, batch, count, started)
+        except (OSError, ValueError, csv.Error) as error:
+            raise CommandError(f'Строка {count + 1}: {error}')
+        finally:
+            if count:
+                bump_catalog_version()
+        elapsed = max(time.monotonic() - started, 1e-6)
+        self.stdout.write(self.style.SUCCESS(
+            f'Загружено строк: {count} за {elapsed:.1f} с '
+            f'({count / elapsed:.0f} строк/с).'))
+
+    @staticmethod
+    def json_row(item):
+        if not isinstance(item, dict):
+            raise ValueError('Ожидался объект.')
+        return item.get('name'), item.get('measurement_unit')
+
+    @staticmethod
+    def clean_row(row, number):
+        if len(row) != 2 or not all(isinstance(value, str) for value in row):
+            raise CommandError(
+                f'Строка {number}: ожидались название и единица измерения.')
+        name, measurement_unit = (value.strip() for value in row)
+        if not name or not measurement_unit or max(
+                len(name), len(measurement_unit)) > 200:
+            raise CommandError(
+                f'Строка {number}: пустое или слишком длинное значение.')
+        return name, measurement_unit
+
+    def save_batch(self, upsert, batch, count, started):
+        with transaction.atomic():
+            Recipe.objects.filter(
+                ingredients__in=upsert(batch)).invalidate_documents()
+        if self.verbosity > 1:
+            elapsed = max(time.monotonic() - started, 1e-6)
+            self.stdout.write(
+                f'Обработано строк: {count} ({count / elapsed:.0f} строк/с).')
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes.documents import build_documents
+from recipes.models import Recipe
+
+BATCH_SIZE = 500
+
+
+class Command(BaseCommand):
+    """Сборка документов для чтения рецептов."""
+    help = ('Собирает недостающие документы рецептов, которые иначе '
+            'соберутся при первом чтении.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force', action='store_true',
+            help='Пересобрать документы всех рецептов.')
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Только проверить, что документы всех рецептов собраны.')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.all()
+        if not options['force']:
+            recipes = recipes.filter(read_document__isnull=True)
+        recipe_ids = list(recipes.order_by('id').values_list('id', flat=True))
+        if options['check']:
+            if recipe_ids:
+                raise CommandError(
+                    f'Рецептов без документа: {len(recipe_ids)}.')
+            self.stdout.write(self.style.SUCCESS('Документы всех рецептов '
+                                                 'собраны.'))
+            return
+        built = 0
+        batch_size = options['batch_size']
+        for start in range(0, len(recipe_ids), batch_size):
+            built += len(build_documents(
+                recipe_ids[start:start + batch_size]))
+        self.stdout.write(self.style.SUCCESS(
+            f'Собрано документов: {built} из {len(recipe_ids)}.'))
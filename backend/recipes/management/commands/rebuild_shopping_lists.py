@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Exists, OuterRef
+
+from recipes.models import ShoppingCart, ShoppingListItem
+from users.models import User
+
+
+class Command(BaseCommand):
+    """Пересборка и проверка материализованных списков покупок."""
+    help = 'Пересобирает и проверяет списки покупок всех пользователей.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Только проверить списки, ничего не исправляя.')
+
+    def handle(self, *args, **options):
+        users = User.objects.filter(
+            Exists(ShoppingCart.objects.filter(user=OuterRef('pk')))
+            | Exists(ShoppingListItem.objects.filter(user=OuterRef('pk')))
+        )
+        mismatched = 0
+        for user in users.iterator():
+            expected = ShoppingListItem.objects.calculate(user)
+            actual = dict(ShoppingListItem.objects.filter(
+                user=user).values_list('ingredient', 'amount'))
+            if expected == actual:
+                continue
+            mismatched += 1
+            self.stdout.write(f'Список покупок {user} расходится с корзиной.')
+            if not options['check']:
+                ShoppingListItem.objects.rebuild(user)
+        if options['check'] and mismatched:
+            raise CommandError(f'Расхождений: {mismatched}.')
+        self.stdout.write(self.style.SUCCESS(
+            f'Проверено, расхождений: {mismatched}.'))
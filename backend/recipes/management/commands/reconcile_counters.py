@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import F
+
+from recipes.counters import expected_count
+from recipes.models import Favourites, Recipe
+from users.models import Subscriber, User
+
+COUNTERS = (
+    (Recipe, 'favorites_count', Favourites, 'recipe'),
+    (User, 'recipes_count', Recipe, 'author'),
+    (User, 'subscribers_count', Subscriber, 'author'),
+)
+
+
+class Command(BaseCommand):
+    """Сверка денормализованных счётчиков с фактическими данными."""
+    help = 'Пересчитывает разошедшиеся счётчики рецептов и пользователей.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Только проверить счётчики, ничего не исправляя.')
+
+    def handle(self, *args, **options):
+        mismatched = 0
+        for model, field, related_model, related_field in COUNTERS:
+            expected = expected_count(related_model, related_field)
+            drifted = model.objects.annotate(expected=expected).exclude(
+                **{field: F('expected')})
+            count = drifted.count()
+            if not count:
+                continue
+            mismatched += count
+            self.stdout.write(
+                f'{model._meta.verbose_name_plural}, {field}: '
+                f'расхождений {count}.')
+            if not options['check']:
+                model.objects.filter(pk__in=drifted.values('pk')).update(
+                    **{field: expected})
+        if options['check'] and mismatched:
+            raise CommandError(f'Расхождений: {mismatched}.')
+        self.stdout.write(self.style.SUCCESS(
+            f'Проверено, расхождений: {mismatched}.'))
@@ -0,0 +1,23 @@
+# Generated by Django 3.2.3 on 2026-10-18 06:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0011_recipe_image_variants'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='read_document',
+            field=models.JSONField(editable=False, null=True, verbose_name='Документ для чтения'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='read_document_version',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Версия документа'),
+        ),
+    ]
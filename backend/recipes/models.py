@@ -1,6 +1,12 @@
-from django.db import models
+from django.contrib.postgres.search import SearchVectorField
+from django.db import models, transaction
+from django.db.models import (BooleanField, Case, Exists, F, IntegerField,
+                              OuterRef, Prefetch, Sum, Value, When, Window)
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Greatest, RowNumber
 
-from users.models import User
+from .counters import CounterFieldsMixin
+from users.models import Subscriber, User
 
 
 class Tag(models.Model):
@@ -45,8 +51,82 @@ class Ingredient(models.Model):
         return self.name
 
 
-class Recipe(models.Model):
+class RecipeQuerySet(models.QuerySet):
+    """Набор запросов для рецептов."""
+
+    def with_user_flags(self, user):
+        """Аннотирует рецепты признаками избранного и списка покупок."""
+        if not user.is_authenticated:
+            return self.annotate(
+                is_favorited=Value(False, output_field=BooleanField()),
+                is_in_shopping_cart=Value(False, output_field=BooleanField()))
+        return self.annotate(
+            is_favorited=Exists(Favourites.objects.filter(
+                user=user, recipe=OuterRef('pk'))),
+            is_in_shopping_cart=Exists(ShoppingCart.objects.filter(
+                user=user, recipe=OuterRef('pk'))))
+
+    def with_author_subscribed(self, user):
+        """Аннотирует рецепты признаком подписки на автора."""
+        if user.is_authenticated:
+            is_author_subscribed = Exists(Subscriber.objects.filter(
+                user=user, author=OuterRef('author')))
+        else:
+            is_author_subscribed = Value(False, output_field=BooleanField())
+        return self.annotate(is_author_subscribed=is_author_subscribed)
+
+    def with_relations(self):
+        """Загружает автора, теги и ингредиенты рецептов."""
+        return self.defer(
+            'search_vector'
+        ).select_related(
+            'author'
+        ).prefetch_related(
+            'tags',
+            Prefetch('recipeingredients',
+                     queryset=RecipeIngredient.objects.select_related(
+                         'ingredients').order_by('id')),
+        )
+
+    def for_read(self, user):
+        """Загружает всё, что нужно для отображения рецептов."""
+        return self.with_user_flags(user).with_relations(
+        ).with_author_subscribed(user)
+
+    def for_documents(self, user):
+        """Загружает готовые документы рецептов и признаки пользователя."""
+        return self.with_user_flags(user).only(
+            'id', 'name', 'author', 'updated_at', 'read_document',
+            'read_document_version',
+        ).with_author_subscribed(user)
+
+    def invalidate_documents(self):
+        """Сбрасывает документы рецептов, их соберёт следующее чтение.
+
+        Версия документа растёт в транзакции изменения, поэтому сборка,
+        прочитавшая старые данные, не сохранит устаревший документ.
+        """
+        return self.update(
+            read_document=None,
+            read_document_version=F('read_document_version') + 1)
+
+    def limited_per_author(self, limit):
+        """Оставляет не больше limit первых рецептов каждого автора."""
+        ranked = self.order_by().annotate(row_number=Window(
+            expression=RowNumber(),
+            partition_by=F('author'),
+            order_by=[F('name').asc(), F('id').asc()],
+        )).values('id', 'row_number')
+        sql, params = ranked.query.sql_with_params()
+        return self.filter(id__in=RawSQL(
+            f'SELECT ranked.id FROM ({sql}) ranked '
+            f'WHERE ranked.row_number <= %s',
+            (*params, limit)))
+
+
+class Recipe(CounterFieldsMixin, models.Model):
     """Модель для рецептов."""
+    counter_fields = ('favorites_count',)
     author = models.ForeignKey(User, on_delete=models.CASCADE,
                                related_name='recipes',
                                verbose_name='Автор',
@@ -70,11 +150,28 @@ class Recipe(models.Model):
     cooking_time = models.PositiveSmallIntegerField(
         verbose_name='Время приготовления',
         help_text='Укажите время приготовления от 1 мин')
+    updated_at = models.DateTimeField(auto_now=True,
+                                      verbose_name='Дата изменения')
+    search_vector = SearchVectorField(null=True, editable=False,
+                                      verbose_name='Поисковый вектор')
+    favorites_count = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name='В избранном')
+    image_variants = models.JSONField(
+        default=dict, blank=True, editable=False,
+        verbose_name='Копии изображения')
+    read_document = models.JSONField(
+        null=True, editable=False, verbose_name='Документ для чтения')
+    read_document_version = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name='Версия документа')
+
+    objects = RecipeQuerySet.as_manager()
 
     class Meta:
         ordering = ('name',)
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
+        indexes = [models.Index(fields=['name', 'id'],
+                                name='recipe_name_id_idx')]
 
     def __str__(self):
         return self.name
@@ -153,3 +250,117 @@ class ShoppingCart(models.Model):
 
     def __str__(self):
         return f"{self.user} - {self.recipe}"
+
+
+class ShoppingListItemQuerySet(models.QuerySet):
+    """Набор запросов для материализованного списка покупок."""
+
+    def calculate(self, user):
+        """Считает список покупок пользователя по его корзине."""
+        return dict(RecipeIngredient.objects.filter(
+            recipe__in=ShoppingCart.objects.filter(
+                user=user).values('recipe')
+        ).values('ingredients').annotate(
+            total=Sum('amount')
+        ).order_by().values_list('ingredients', 'total'))
+
+    def rebuild(self, user):
+        """Пересобирает список покупок пользователя с нуля."""
+        with transaction.atomic():
+            self.filter(user=user).delete()
+            self.bulk_create([
+                self.model(user=user, ingredient_id=ingredient_id,
+                           amount=amount)
+                for ingredient_id, amount in self.calculate(user).items()
+            ])
+
+    def apply_delta(self, user_ids, delta):
+        """Прибавляет изменения количеств к спискам покупок.
+
+        Недостающие позиции вставляются с нулём без конфликтов, а
+        количества меняются через F(), поэтому одновременные изменения
+        одного списка не теряются и не нарушают уникальность.
+        """
+        delta = {ingredient_id: amount
+                 for ingredient_id, amount in delta.items() if amount}
+        user_ids = list(user_ids)
+        if not delta or not user_ids:
+            return
+        with transaction.atomic():
+            self.bulk_create([
+                self.model(user_id=user_id, ingredient_id=ingredient_id,
+                           amount=0)
+                for user_id in user_ids
+                for ingredient_id, amount in delta.items() if amount > 0
+            ], ignore_conflicts=True)
+            items = self.filter(user__in=user_ids, ingredient__in=delta)
+            items.update(amount=Greatest(F('amount') + Case(
+                *(When(ingredient=ingredient_id, then=Value(amount))
+                  for ingredient_id, amount in delta.items()),
+                default=Value(0), output_field=IntegerField()), 0))
+            items.filter(amount=0).delete()
+
+    def add_recipe(self, user, recipe, sign=1):
+        """Добавляет ингредиенты рецепта в список покупок."""
+        self.apply_delta([user.id], {
+            ingredient_id: sign * amount
+            for ingredient_id, amount in recipe.recipeingredients.values_list(
+                'ingredients', 'amount')
+        })
+
+    def remove_recipe(self, user, recipe):
+        """Убирает ингредиенты рецепта из списка покупок."""
+        self.add_recipe(user, recipe, sign=-1)
+
+    def change_recipe(self, recipe, old_amounts, new_amounts):
+        """Переносит изменение ингредиентов рецепта в списки покупок."""
+        delta = {
+            ingredient_id: (new_amounts.get(ingredient_id, 0)
+                            - old_amounts.get(ingredient_id, 0))
+            for ingredient_id in old_amounts.keys() | new_amounts.keys()
+        }
+        self.apply_delta(ShoppingCart.objects.filter(
+            recipe=recipe).values_list('user', flat=True), delta)
+
+
+class ShoppingListItem(models.Model):
+    """Модель для материализованного списка покупок."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE,
+                             related_name='shoppinglistitems',
+                             verbose_name='Пользователь',
+                             help_text='Назовите пользователя')
+    ingredient = models.ForeignKey(Ingredient, on_delete=models.CASCADE,
+                                   related_name='shoppinglistitems',
+                                   verbose_name='Ингредиент',
+                                   help_text='Назовите ингредиента')
+    amount = models.PositiveIntegerField(
+        verbose_name='Сколько ингредиента',
+        help_text='Суммарное количество ингредиента в корзине')
+
+    objects = ShoppingListItemQuerySet.as_manager()
+
+    class Meta:
+        ordering = ('user', 'ingredient')
+        verbose_name = 'Позиция списка покупок'
+        verbose_name_plural = 'Позиции списка покупок'
+        constraints = [models.UniqueConstraint(
+            fields=['user', 'ingredient'],
+            name='unique_shoppinglist_user_ingredient')]
+
+    def __str__(self):
+        return f'{self.user}: {self.ingredient} - {self.amount}'
+
+
+class PantryIndexChange(models.Model):
+    """Журнал рецептов с изменённым составом для индекса кладовой."""
+    recipe_id = models.PositiveBigIntegerField(verbose_name='Id рецепта')
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True,
+                                      verbose_name='Дата изменения')
+
+    class Meta:
+        ordering = ('created_at',)
+        verbose_name = 'Изменение индекса кладовой'
+        verbose_name_plural = 'Изменения индекса кладовой'
+
+    def __str__(self):
+        return f'{self.recipe_id}: {self.created_at}'
@@ -0,0 +1,165 @@
+import os
+from datetime import datetime, timedelta
+from itertools import chain
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+
+from .models import PantryIndexChange, RecipeIngredient
+
+PANTRY_SYNC_OVERLAP = timedelta(seconds=30)
+PANTRY_CHANGE_RETENTION = timedelta(days=1)
+PANTRY_CHUNK_SIZE = 10000
+
+_index = None
+
+
+class PantryIndex:
+    """Инвертированный индекс: ингредиент -> отсортированные id рецептов.
+
+    Хранит для каждого ингредиента массив id рецептов, а для каждого
+    рецепта - число его ингредиентов. Строится командой
+    build_pantry_index в файл, процессы загружают файл и догоняют его по
+    журналу PantryIndexChange.
+    """
+    __slots__ = ('postings', 'totals', 'synced_at', 'file_version')
+
+    def __init__(self, postings, totals, synced_at, file_version=None):
+        self.postings = postings
+        self.totals = totals
+        self.synced_at = synced_at
+        self.file_version = file_version
+
+    @classmethod
+    def build(cls):
+        """Индекс по всем рецептам, читает таблицу целиком."""
+        synced_at = timezone.now()
+        rows = RecipeIngredient.objects.order_by().values_list(
+            'ingredients_id', 'recipe_id'
+        ).iterator(chunk_size=PANTRY_CHUNK_SIZE)
+        pairs = np.fromiter(chain.from_iterable(rows),
+                            dtype=np.int64).reshape(-1, 2)
+        ingredient_ids, recipe_ids = pairs[:, 0], pairs[:, 1]
+        order = np.lexsort((recipe_ids, ingredient_ids))
+        ingredient_ids, recipe_ids = ingredient_ids[order], recipe_ids[order]
+        keys, starts = np.unique(ingredient_ids, return_index=True)
+        postings = {
+            int(key): array for key, array in zip(
+                keys, np.split(recipe_ids, starts[1:]) if len(keys) else [])
+        }
+        totals = np.bincount(recipe_ids).astype(np.int32)
+        return cls(postings, totals, synced_at)
+
+    def save(self, path):
+        """Атомарно записывает индекс в файл."""
+        keys = np.array(sorted(self.postings), dtype=np.int64)
+        arrays = [self.postings[key] for key in keys.tolist()]
+        lengths = np.array([len(array) for array in arrays], dtype=np.int64)
+        temporary = f'{path}.{os.getpid()}.tmp'
+        with open(temporary, 'wb') as file:
+            np.savez(
+                file, keys=keys, lengths=lengths,
+                recipe_ids=(np.concatenate(arrays) if arrays
+                            else np.empty(0, dtype=np.int64)),
+                totals=self.totals,
+                synced_at=np.array(self.synced_at.timestamp()))
+        os.replace(temporary, path)
+
+    @classmethod
+    def load(cls, path, file_version):
+        with np.load(path) as data:
+            keys, lengths = data['keys'], data['lengths']
+            postings = dict(zip(
+                keys.tolist(),
+                np.split(data['recipe_ids'], np.cumsum(lengths)[:-1])
+                if len(keys) else []))
+            return cls(postings, data['totals'], datetime.fromtimestamp(
+                float(data['synced_at']), timezone.utc), file_version)
+
+    def sync(self):
+        """Применяет изменения рецептов из журнала."""
+        synced_at = timezone.now()
+        recipe_ids = set(PantryIndexChange.objects.filter(
+            created_at__gte=self.synced_at - PANTRY_SYNC_OVERLAP
+        ).values_list('recipe_id', flat=True))
+        if recipe_ids:
+            self.apply(recipe_ids)
+        self.synced_at = synced_at
+
+    def apply(self, recipe_ids):
+        """Заменяет в индексе состав рецептов на текущий из базы."""
+        changed = np.array(sorted(recipe_ids), dtype=np.int64)
+        for ingredient_id, postings in self.postings.items():
+            positions = np.searchsorted(postings, changed)
+            found = positions < len(postings)
+            found[found] = postings[positions[found]] == changed[found]
+            if found.any():
+                self.postings[ingredient_id] = np.delete(
+                    postings, positions[found])
+        if changed[-1] >= len(self.totals):
+            self.totals = np.concatenate((self.totals, np.zeros(
+                changed[-1] + 1 - len(self.totals), dtype=np.int32)))
+        self.totals[changed] = 0
+        for ingredient_id, recipe_id in RecipeIngredient.objects.filter(
+                recipe_id__in=recipe_ids).values_list('ingredients_id',
+                                                      'recipe_id'):
+            postings = self.postings.get(ingredient_id,
+                                         np.empty(0, dtype=np.int64))
+            self.postings[ingredient_id] = np.insert(
+                postings, np.searchsorted(postings, recipe_id), recipe_id)
+            self.totals[recipe_id] += 1
+
+    def search(self, ingredient_ids, max_missing):
+        """Рецепты, которым не хватает не более max_missing ингредиентов.
+
+        Возвращает массивы id рецептов и числа недостающих ингредиентов,
+        упорядоченные по недостающим, затем по совпавшим ингредиентам.
+        """
+        postings = [self.postings[ingredient_id]
+                    for ingredient_id in set(ingredient_ids)
+                    if ingredient_id in self.postings]
+        if not postings:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int32)
+        matched = np.bincount(np.concatenate(postings),
+                              minlength=len(self.totals))
+        missing = self.totals - matched
+        candidates = np.flatnonzero((matched > 0) & (missing <= max_missing))
+        order = np.argsort(
+            missing[candidates] * (len(ingredient_ids) + 1)
+            - matched[candidates], kind='stable')
+        candidates = candidates[order]
+        return candidates, missing[candidates]
+
+
+def record_pantry_change(*recipe_ids):
+    """Отмечает рецепты с изменённым составом для индекса кладовой."""
+    PantryIndexChange.objects.bulk_create(
+        PantryIndexChange(recipe_id=recipe_id) for recipe_id in recipe_ids)
+
+
+def build_pantry_index():
+    """Строит индекс в файл и удаляет старые записи журнала."""
+    index = PantryIndex.build()
+    index.save(settings.PANTRY_INDEX_PATH)
+    PantryIndexChange.objects.filter(
+        created_at__lt=index.synced_at - PANTRY_CHANGE_RETENTION).delete()
+    return index
+
+
+def get_pantry_index():
+    """Индекс кладовой из файла, догнанный по журналу изменений.
+
+    Возвращает None, если индекс ещё не построен. Сам индекс здесь не
+    строится и в базу ничего не пишется.
+    """
+    global _index
+    path = settings.PANTRY_INDEX_PATH
+    try:
+        file_version = (path, os.stat(path).st_mtime_ns)
+    except FileNotFoundError:
+        return None
+    if _index is None or _index.file_version != file_version:
+        _index = PantryIndex.load(path, file_version)
+    _index.sync()
+    return _index
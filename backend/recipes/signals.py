@@ -0,0 +1,161 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete)
+from django.dispatch import receiver
+
+from .catalog import bump_catalog_version
+from .models import Ingredient, Recipe, RecipeIngredient, Tag
+from .versions import (RECIPE_LIST_VERSION_KEY, RECIPE_RESPONSES_VERSION_KEY,
+                       bump_version, recipe_version_key)
+from users.models import User
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def catalog_changed(sender, **kwargs):
+    """Сброс снимка справочника после изменения тегов и ингредиентов."""
+    transaction.on_commit(bump_catalog_version)
+
+
+RECIPE_LIST_FIELDS = {'name', 'text', 'author'}
+
+
+def bump_recipe_list_version():
+    transaction.on_commit(partial(bump_version, RECIPE_LIST_VERSION_KEY))
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_saved(sender, created, update_fields, **kwargs):
+    """Новый рецепт и смена полей поиска и фильтров меняют количества."""
+    if (created or update_fields is None
+            or RECIPE_LIST_FIELDS & set(update_fields)):
+        bump_recipe_list_version()
+
+
+@receiver(post_delete, sender=Recipe)
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def recipe_list_changed(sender, **kwargs):
+    """Сброс кэшированных количеств рецептов в списках."""
+    bump_recipe_list_version()
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def recipe_tags_changed(sender, action, **kwargs):
+    """Смена тегов рецепта меняет результаты фильтра по тегам."""
+    if action.startswith('post_'):
+        bump_recipe_list_version()
+
+
+def bump_recipe_responses_version(*recipe_ids):
+    transaction.on_commit(partial(
+        bump_version, RECIPE_RESPONSES_VERSION_KEY,
+        *map(recipe_version_key, recipe_ids)))
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def recipe_responses_changed(sender, instance, **kwargs):
+    """Сброс кэша ответов при изменении рецепта."""
+    bump_recipe_responses_version(instance.pk)
+
+
+@receiver(post_save, sender=RecipeIngredient)
+@receiver(post_delete, sender=RecipeIngredient)
+def recipe_ingredient_responses_changed(sender, instance, **kwargs):
+    """Сброс кэша ответов при изменении ингредиентов рецепта."""
+    bump_recipe_responses_version(instance.recipe_id)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def recipe_tags_responses_changed(sender, instance, action, pk_set,
+                                  reverse, **kwargs):
+    """Сброс кэша ответов при смене тегов рецепта."""
+    if not action.startswith('post_'):
+        return
+    if reverse:
+        bump_recipe_responses_version(*(pk_set or ()))
+    else:
+        bump_recipe_responses_version(instance.pk)
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def tag_responses_changed(sender, **kwargs):
+    """Сброс кэша списков рецептов при изменении тега."""
+    bump_recipe_responses_version()
+
+
+AUTHOR_CARD_FIELDS = {'username', 'first_name', 'last_name', 'email',
+                      'avatar'}
+
+
+def author_card_changed(created, update_fields):
+    """Могла ли измениться карточка автора в ответах с рецептами."""
+    return not created and (update_fields is None
+                            or bool(AUTHOR_CARD_FIELDS & set(update_fields)))
+
+
+@receiver(post_save, sender=User)
+def author_responses_changed(sender, instance, created, update_fields,
+                             **kwargs):
+    """Сброс кэша ответов с карточкой изменённого автора."""
+    if not author_card_changed(created, update_fields):
+        return
+    recipe_ids = list(instance.recipes.values_list('pk', flat=True))
+    if recipe_ids:
+        bump_recipe_responses_version(*recipe_ids)
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_document_changed(sender, instance, created, **kwargs):
+    """Сброс документа изменённого рецепта."""
+    if not created:
+        Recipe.objects.filter(pk=instance.pk).invalidate_documents()
+
+
+@receiver(post_save, sender=RecipeIngredient)
+@receiver(post_delete, sender=RecipeIngredient)
+def recipe_ingredient_document_changed(sender, instance, **kwargs):
+    """Сброс документа при изменении ингредиентов рецепта."""
+    Recipe.objects.filter(pk=instance.recipe_id).invalidate_documents()
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def recipe_tags_document_changed(sender, instance, action, pk_set,
+                                 reverse, **kwargs):
+    """Сброс документов при смене тегов рецепта."""
+    if reverse and action == 'pre_clear':
+        Recipe.objects.filter(tags=instance).invalidate_documents()
+    elif reverse and action in ('post_add', 'post_remove'):
+        Recipe.objects.filter(pk__in=pk_set).invalidate_documents()
+    elif not reverse and action.startswith('post_'):
+        Recipe.objects.filter(pk=instance.pk).invalidate_documents()
+
+
+@receiver(post_save, sender=Tag)
+@receiver(pre_delete, sender=Tag)
+def tag_document_changed(sender, instance, **kwargs):
+    """Сброс документов рецептов с изменённым или удаляемым тегом."""
+    if not kwargs.get('created'):
+        Recipe.objects.filter(tags=instance).invalidate_documents()
+
+
+@receiver(post_save, sender=Ingredient)
+def ingredient_document_changed(sender, instance, created, **kwargs):
+    """Сброс документов рецептов с изменённым ингредиентом."""
+    if not created:
+        Recipe.objects.filter(ingredients=instance).invalidate_documents()
+
+
+@receiver(post_save, sender=User)
+def author_document_changed(sender, instance, created, update_fields,
+                            **kwargs):
+    """Сброс документов рецептов с карточкой изменённого автора."""
+    if not author_card_changed(created, update_fields):
+        return
+    Recipe.objects.filter(author=instance).invalidate_documents()
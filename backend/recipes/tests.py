@@ -0,0 +1,81 @@
+from django.test import TestCase
+
+from .counters import change_counter
+from .models import Ingredient, Recipe, RecipeIngredient, Tag
+from users.models import Subscriber, User
+
+
+class CounterFieldsTest(TestCase):
+    """Полное сохранение не затирает счётчики, изменённые через F()."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create(
+            username='author', email='author@example.com',
+            first_name='Автор', last_name='Рецептов')
+        cls.recipe = Recipe.objects.create(
+            author=cls.author, name='Рецепт', text='Описание',
+            cooking_time=10, image='recipes_images/test.png')
+
+    def test_full_save_keeps_counters(self):
+        recipe = Recipe.objects.get(pk=self.recipe.pk)
+        author = User.objects.get(pk=self.author.pk)
+        change_counter(Recipe, recipe.pk, 'favorites_count', 2)
+        change_counter(User, author.pk, 'subscribers_count', 3)
+        recipe.name = 'Новое название'
+        recipe.save()
+        author.first_name = 'Новое имя'
+        author.save()
+        recipe.refresh_from_db()
+        author.refresh_from_db()
+        self.assertEqual(recipe.name, 'Новое название')
+        self.assertEqual(recipe.favorites_count, 2)
+        self.assertEqual(author.first_name, 'Новое имя')
+        self.assertEqual(author.subscribers_count, 3)
+
+
+class AdminChangelistQueriesTest(TestCase):
+    """Число запросов в списках админки не зависит от числа строк."""
+    rows = 100
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser(
+            username='admin', email='admin@example.com', password='admin')
+        authors = [
+            User.objects.create(username=f'author_{number}',
+                                email=f'author_{number}@example.com')
+            for number in range(cls.rows)
+        ]
+        for author in authors[1:]:
+            Subscriber.objects.create(user=author, author=authors[0])
+        tags = [Tag.objects.create(name=f'Тег {number}', slug=f'tag-{number}')
+                for number in range(3)]
+        ingredients = [
+            Ingredient.objects.create(name=f'Ингредиент {number}',
+                                      measurement_unit='г')
+            for number in range(3)
+        ]
+        for number, author in enumerate(authors):
+            recipe = Recipe.objects.create(
+                author=author, name=f'Рецепт {number}', text='Описание',
+                cooking_time=10, image='recipes_images/test.png')
+            recipe.tags.set(tags)
+            for ingredient in ingredients:
+                RecipeIngredient.objects.create(
+                    recipe=recipe, ingredients=ingredient, amount=100)
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def assert_changelist(self, path, queries):
+        with self.assertNumQueries(queries):
+            response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['cl'].result_list), self.rows)
+
+    def test_recipe_changelist(self):
+        self.assert_changelist('/admin/recipes/recipe/', 8)
+
+    def test_user_changelist(self):
+        self.assert_changelist('/admin/users/user/?is_staff__exact=0', 6)
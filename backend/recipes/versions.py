@@ -0,0 +1,24 @@
+from uuid import uuid4
+
+from django.core.cache import cache
+
+RECIPE_LIST_VERSION_KEY = 'recipes:recipe_list:version'
+RECIPE_RESPONSES_VERSION_KEY = 'recipes:recipe_responses:version'
+
+
+def recipe_version_key(recipe_id):
+    return f'recipes:recipe:{recipe_id}:version'
+
+
+def bump_version(*keys):
+    """Сбрасывает всё, что закэшировано под версиями keys."""
+    cache.set_many({key: uuid4().hex for key in keys}, timeout=None)
+
+
+def get_version(key):
+    """Текущая версия key, общая для всех процессов."""
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, uuid4().hex, timeout=None)
+        version = cache.get(key)
+    return version
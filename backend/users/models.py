@@ -3,8 +3,10 @@ from django.contrib.auth.models import AbstractUser
 from django.contrib.auth.validators import UnicodeUsernameValidator
 from django.db import models
 
+from recipes.counters import CounterFieldsMixin
 
-class User(AbstractUser):
+
+class User(CounterFieldsMixin, AbstractUser):
     """Модель пользователя."""
     REQUIRED_FIELDS = [
         'username',
@@ -12,6 +14,7 @@ class User(AbstractUser):
         'last_name',
     ]
     USERNAME_FIELD = 'email'
+    counter_fields = ('recipes_count', 'subscribers_count')
 
     username = models.CharField(
         unique=True, max_length=150,
@@ -33,6 +36,10 @@ class User(AbstractUser):
     avatar = models.ImageField(
         upload_to='avatars/', null=True, blank=True,
         verbose_name='Аватар', help_text='Выложите аватар')
+    recipes_count = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name='Рецептов')
+    subscribers_count = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name='Подписчиков')
 
     class Meta:
         ordering = ('username',)